@@ -22,19 +22,81 @@ This module contains all helper objects that facilitate creation of rendered geo
 
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, List, Iterator
-from numpy import float64,dot
+from typing import TYPE_CHECKING, List, Iterator, Set, Tuple
+from numpy import float64,dot,int64,ndarray,zeros
 from abc import ABC, abstractmethod
 
 from global_scope import real_global_scope as the
+from parsing import COLUMN_INDEX
 
 if TYPE_CHECKING: 
     from rendered_geometry import WordBox,DragBox
-    from parsing import Displacements
+    from parsing import BoxStore, Displacements
 
 horizontal_edge_names = ['left','right']
 vertical_edge_names = ['top','bottom']
 edge_names = [*horizontal_edge_names,*vertical_edge_names]
+# Column of each edge in the arrays of the screen transform. They follow the order of a Displacements object.
+transform_columns = {name: index for index,name in enumerate(['left','top','right','bottom'])}
+
+class ScreenTransform():
+    ''' 
+    Affine transform (scale plus vertical flip) from the file coordinates of all boxes in a store to 
+    the coordinates they are rendered at. It is applied to every box at once and its results are cached 
+    until the scale or the image change, or until a specific box is edited (then only that row is redone).
+    It's kept by the store itself, so it goes away along with the store.
+    '''
+
+    @classmethod
+    def of(cls: ScreenTransform, store: BoxStore) -> ScreenTransform:
+        ''' Return the transform of the store, creating it on first use. '''
+        if store.transform is None: store.transform = cls(store)
+        return store.transform
+
+    def _transform(self, rows: slice|List[int]) -> Tuple[ndarray,ndarray]:
+        ''' Return the scaled and the flipped screen coordinates of the rows. '''
+        coordinates = self.store.coordinates[rows][:,self._columns]
+        scaled = (coordinates*the.scale).astype(int64)
+        screen = scaled.copy()
+        screen[:,self._vertical] = the.rendered_size[1] - screen[:,self._vertical]
+        return scaled, screen
+
+    def refresh(self):
+        ''' Recompute all rows if the scale, image or store size changed, or only the edited rows otherwise. '''
+        key = (the.scale,the.rendered_size[1],len(self.store),)
+        if key != self.key:
+            self._scaled, self._screen = self._transform(slice(None))
+            self._dirty_rows.clear()
+            self.key = key
+        elif self._dirty_rows:
+            rows = sorted(self._dirty_rows)
+            self._scaled[rows], self._screen[rows] = self._transform(rows)
+            self._dirty_rows.clear()
+
+    @property
+    def scaled(self) -> ndarray: 
+        ''' Return the (left, top, right, bottom) coordinates of all boxes scaled to the canvas, in box file orientation. '''
+        self.refresh()
+        return self._scaled
+
+    @property
+    def screen(self) -> ndarray:
+        ''' Return the (left, top, right, bottom) coordinates of all boxes on the canvas, in screen orientation. '''
+        self.refresh()
+        return self._screen
+
+    def invalidate_row(self, row: int): self._dirty_rows.add(row)
+
+    def __init__(self, store: BoxStore) -> None:
+        self.store = store
+        self.key: Tuple[float,int,int]|None = None
+        self._columns = [COLUMN_INDEX[name] for name in transform_columns]
+        self._vertical = [transform_columns[name] for name in vertical_edge_names]
+        self._scaled: ndarray = zeros((0,4),dtype=int64)
+        self._screen: ndarray = zeros((0,4),dtype=int64)
+        self._dirty_rows: Set[int] = set()
+        # Go first, so the listeners that read transformed coordinates never see stale rows.
+        store.listeners.insert(0,self.invalidate_row)
 
 class RenderedBox(ABC):
     ''' Interface for all boxes that can be displayed on the canvas. '''
@@ -49,21 +111,19 @@ class RenderedBox(ABC):
 
     def contains(self,point: List[int,int]) -> bool:
         ''' Return wether the point is within the bounds of this box. '''
-        left = self.displacements.left
-        top = the.buffered_image.height - self.displacements.top
-        right = self.displacements.right
-        bottom = the.buffered_image.height - self.displacements.bottom
+        left, top, right, bottom = self.displacements
+        top, bottom = the.rendered_size[1] - top, the.rendered_size[1] - bottom
         return (left <= point[0] <= right) and (top <= point[1] <= bottom)
 
 class EdgeCenter():
     ''' Object that maintains the center position of a rendered edge. '''
     
     @property
-    def position(self) -> float64:
-        ''' Return the vector corresponding to the center coordinates of the edge. '''
-        vector_1 = self.edge.axis * self.edge.displacement
-        vector_2 = self.edge.perpendicular_axis * self.wordbox.rendered.center
-        return vector_1 + vector_2
+    def position(self) -> Tuple[float,float]:
+        ''' Return the center coordinates of the edge, without allocating any intermediate vectors. '''
+        x, y = self.wordbox.rendered.center
+        if self.edge.name in horizontal_edge_names: return (self.edge.displacement,y,)
+        return (x,self.edge.displacement,)
 
     @position.setter
     def position(self, value: List[int,int]):
@@ -83,13 +143,14 @@ class Edge():
 
     @property
     def displacement(self) -> int:
-        ''' Get the rendered displacement value of the edge''' 
-        return int(the.scale*getattr(self.core_displacements,self.name))
+        ''' Get the rendered displacement value of the edge from the precomputed screen transform.''' 
+        transform = ScreenTransform.of(self.core_displacements.store)
+        return int(transform.scaled[self.core_displacements.row,self.column])
 
     @displacement.setter
     def displacement(self,value: int):
         ''' Set the core displacements of the edge based on a change in the rendered displacement.'''
-        if self.name in vertical_edge_names: value = the.buffered_image.height - value
+        if self.name in vertical_edge_names: value = the.rendered_size[1] - value
         new_value = int(value/the.scale)
         setattr(self.core_displacements,self.name,new_value)
 
@@ -101,6 +162,7 @@ class Edge():
         self.center = EdgeCenter(self)
         self.dragbox: DragBox = None
         self.name = name
+        self.column = transform_columns[name]
 
     def __repr__(self) -> str: return f'{self.displacement}'
 
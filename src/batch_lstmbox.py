@@ -0,0 +1,213 @@
+#
+#    HyperKyube: OCR Gui MultiTool.
+#
+#    Copyright 2022 Daniel Gesua
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#   
+
+'''
+Headless command line tool that (re)generates the LSTM box files of every tiff image in a directory tree,
+running tesseract on several images at once in a pool of worker processes:
+
+    python batch_lstmbox.py <directory> [--jobs N] [--lang eng] [--force] [--no-cache] [--backend name] [--tesseract path/to/tesseract]
+
+Images whose box file is already up to date are skipped. A box file is up to date when it's newer than its
+image, or when the image's content hash still matches the one recorded in the directory's manifest when 
+the box file was generated (so copied or touched images aren't processed again). Progress and throughput 
+are printed as images complete, and Ctrl+C cancels the remaining images cleanly, keeping the finished ones.
+Tesseract outputs are looked up in the tesseract output cache first, so regenerating unchanged images is cheap.
+'''
+
+from __future__ import annotations
+
+
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import pytesseract
+
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple
+
+from box_cache import file_digest
+from box_writer import fsync_enabled, write_atomically
+from ocr_backends import BACKENDS, get_backend
+from ocr_cache import ocr_cache
+from tesseract_automation import make_lstmbox_file
+
+IMAGE_SUFFIXES = ('.tif','.tiff',)
+MANIFEST_NAME = '.lstmbox_manifest.json'
+
+
+class Outcome(NamedTuple):
+    ''' The result of generating the box file of one image. '''
+    image_path: Path
+    digest: str
+    error: str
+    cached: bool = False
+
+
+class Summary(NamedTuple):
+    ''' How many box files a batch run generated, skipped and failed to generate, and whether it was cancelled. '''
+    generated: int
+    skipped: int
+    failed: int
+    cancelled: bool
+
+
+def find_images(directory: Path) -> List[Path]:
+    ''' Return the paths of all the tiff images in the directory tree, in order. '''
+    return sorted(path for path in directory.rglob('*') if path.suffix.lower() in IMAGE_SUFFIXES and path.is_file())
+
+
+class Manifest():
+    ''' 
+    Record of the content hash and language of every image at the time its box file was generated,
+    kept as a JSON file at the root of the directory tree.
+    '''
+
+    def is_up_to_date(self, image_path: Path, lang: str) -> bool:
+        ''' Return whether the box file of the image exists and was generated from its current contents. '''
+        box_path = image_path.with_suffix('.box')
+        if not box_path.exists(): return False
+        entry = self.entries.get(self.key(image_path))
+        if entry is not None and entry['lang'] != lang: return False
+        if box_path.stat().st_mtime_ns >= image_path.stat().st_mtime_ns: return True
+        return entry is not None and entry['digest'] == file_digest(image_path).hex()
+
+    def record(self, outcome: Outcome, lang: str):
+        ''' Remember the content hash and language the box file of the image was generated from. '''
+        self.entries[self.key(outcome.image_path)] = {'digest': outcome.digest, 'lang': lang}
+
+    def key(self, image_path: Path) -> str: return image_path.relative_to(self.directory).as_posix()
+
+    def save(self): save_manifest(self.path,self.entries)
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self.path = directory / MANIFEST_NAME
+        self.entries: Dict[str,Dict[str,str]] = json.loads(self.path.read_text()) if self.path.exists() else {}
+
+
+def save_manifest(path: Path, entries: Dict):
+    ''' Write the entries of a manifest as JSON atomically, so a cancelled run can't corrupt it. '''
+    write_atomically(path,json.dumps(entries,indent=1,sort_keys=True).encode('utf-8'),fsync_enabled())
+
+
+def initialize_worker(tesseract_cmd: str = None):
+    ''' Let only the main process handle Ctrl+C, and point pytesseract to the requested executable. '''
+    signal.signal(signal.SIGINT,signal.SIG_IGN)
+    if tesseract_cmd: pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+
+
+def generate(image_path: Path, lang: str, use_cache: bool = True, backend_name: str = None) -> Outcome:
+    ''' Generate the box file of the image in a worker process, reporting failures instead of raising them. '''
+    try:
+        hits = ocr_cache.hits
+        key = make_lstmbox_file(str(image_path),lang,cache=ocr_cache if use_cache else None,backend=get_backend(backend_name))
+        return Outcome(image_path,key.image_digest,None,ocr_cache.hits > hits)
+    except Exception as error:
+        return Outcome(image_path,None,str(error).strip() or type(error).__name__)
+
+
+def run_in_pool(work: Callable[[Any],NamedTuple], items: List, finished: Callable[[NamedTuple,Any],None], jobs: int = None, 
+    tesseract_cmd: str = None, context: Callable[[Any],Any] = lambda item: item, noun: str = 'item') -> bool:
+    ''' 
+    Run the work on every item in a pool of worker processes, and call finished with the outcome and the context 
+    of every item as it finishes. The context of an item is taken when it's submitted. Only as many items as there 
+    are workers are submitted at a time, so cancelling with Ctrl+C leaves nothing queued and waits only for the items 
+    already being processed. Return whether the run was cancelled.
+    '''
+    jobs = jobs or os.cpu_count()
+    pending = list(items)
+    running: Dict[Future,Any] = {}
+    with ProcessPoolExecutor(max_workers=jobs,initializer=initialize_worker,initargs=(tesseract_cmd,)) as pool:
+        try:
+            while pending or running:
+                while pending and len(running) < jobs:
+                    item = pending.pop(0)
+                    running[pool.submit(work,item)] = context(item)
+                done, _ = wait(running,return_when=FIRST_COMPLETED)
+                for future in done: 
+                    item_context = running.pop(future)
+                    finished(future.result(),item_context)
+        except KeyboardInterrupt:
+            print(f'Cancelled, waiting for {len(running)} running {noun}(s) to stop...',flush=True)
+            pending.clear()
+            return True
+    return False
+
+
+def report_progress(outcome: Outcome, done: int, total: int, started: float):
+    ''' Print the outcome of an image along with the overall progress and throughput. '''
+    elapsed = time.perf_counter() - started
+    status = f'failed: {outcome.error}' if outcome.error else 'ok (cached)' if outcome.cached else 'ok'
+    print(f'[{done}/{total}] {done/elapsed:.2f} images/s {outcome.image_path}: {status}',flush=True)
+
+
+def run_batch(directory: str, jobs: int = None, lang: str = 'eng', force: bool = False, tesseract_cmd: str = None, use_cache: bool = True, backend_name: str = None) -> Summary:
+    ''' 
+    Generate the box files of the images in the directory tree that aren't up to date, and return a summary
+    of the run. Cancelling with Ctrl+C waits only for the images already being processed.
+    '''
+    directory = Path(directory)
+    manifest = Manifest(directory)
+    images = find_images(directory)
+    pending = [image for image in images if force or not manifest.is_up_to_date(image,lang)]
+    skipped = len(images) - len(pending)
+    print(f'{len(pending)} image(s) to process, {skipped} up to date.',flush=True)
+    generated = failed = cached = 0
+    started = time.perf_counter()
+
+    def finished(outcome: Outcome, image: Path):
+        nonlocal generated, failed, cached
+        if outcome.error: failed += 1
+        else: 
+            generated += 1
+            cached += outcome.cached
+            manifest.record(outcome,lang)
+        report_progress(outcome,generated + failed,len(pending),started)
+
+    work = partial(generate,lang=lang,use_cache=use_cache,backend_name=backend_name)
+    try: cancelled = run_in_pool(work,pending,finished,jobs,tesseract_cmd,noun='image')
+    finally: manifest.save()
+    elapsed = time.perf_counter() - started
+    print(f'{generated} generated ({cached} from cache), {skipped} skipped, {failed} failed in {elapsed:.1f}s.',flush=True)
+    return Summary(generated,skipped,failed,cancelled)
+
+
+def main(arguments: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Generate the LSTM box files of every tiff image in a directory tree.')
+    parser.add_argument('directory',help='root of the directory tree containing the images')
+    parser.add_argument('-j','--jobs',type=int,default=None,help='number of worker processes (default: one per CPU)')
+    parser.add_argument('-l','--lang',default='eng',help='tesseract language to generate the box files with')
+    parser.add_argument('-f','--force',action='store_true',help='regenerate box files even if they are up to date')
+    parser.add_argument('--no-cache',action='store_true',help='always run tesseract instead of reusing cached outputs')
+    parser.add_argument('--backend',choices=list(BACKENDS),default=None,help='OCR backend (default: tesserocr if installed, otherwise subprocess)')
+    parser.add_argument('--tesseract',default=None,help='path to the tesseract executable')
+    args = parser.parse_args(arguments)
+    try:
+        summary = run_batch(args.directory,args.jobs,args.lang,args.force,args.tesseract,not args.no_cache,args.backend)
+    except KeyboardInterrupt:
+        return 130
+    return 130 if summary.cancelled else 1 if summary.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+#
+#    HyperKyube: OCR Gui MultiTool.
+#
+#    Copyright 2022 Daniel Gesua
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#   
+
+'''
+Module responsible for the binary sidecar cache (".boxc" files) that stores the parsed contents 
+of a box file, so reopening an unchanged box file doesn't require re-parsing the whole text.
+
+The sidecar consists of a fixed-size header holding the cache key (the box file's path, size, 
+modification time and content hash) and a digest of the rest of the sidecar, followed by the fixed-width int32 coordinate array, the 
+int64 text offsets, the path and finally the UTF-8 string table of all the word texts. 
+It is loaded with a single read, and the arrays are zero-copy views over the read buffer. 
+A sidecar that is truncated or corrupted doesn't match its payload digest and is ignored.
+'''
+
+from __future__ import annotations
+
+
+import os
+import struct
+import hashlib
+import numpy as np
+
+from pathlib import Path
+from typing import NamedTuple, Tuple
+
+MAGIC = b'BOXC'
+VERSION = 2
+SUFFIX = '.boxc'
+COLUMNS = 5
+
+# Magic, version, box file size, box file mtime (ns), content digest, row count, path length, text length and payload digest.
+_HEADER = struct.Struct('<4sIQq16sQIQ16s')
+_ALIGNMENT = 8
+_CHUNK_SIZE = 1 << 20
+
+
+class CacheKey(NamedTuple):
+    ''' The values identifying the exact version of a box file that a sidecar was made from. '''
+    path: bytes
+    size: int
+    mtime: int
+    digest: bytes
+
+    @classmethod
+    def of(cls: CacheKey, file: str) -> CacheKey:
+        ''' Return the key of the box file as it currently is on disk. '''
+        path = Path(file).resolve()
+        stat = path.stat()
+        return cls(str(path).encode('utf-8'),stat.st_size,stat.st_mtime_ns,file_digest(path))
+
+
+def file_digest(file: str) -> bytes:
+    ''' Return the 16 byte blake2b digest of the contents of the file, reading it in chunks. '''
+    content_hash = hashlib.blake2b(digest_size=16)
+    with open(file,mode='rb') as f: 
+        while (chunk := f.read(_CHUNK_SIZE)): content_hash.update(chunk)
+    return content_hash.digest()
+
+
+def _payload_digest(buffer: bytearray) -> bytes:
+    ''' Return the 16 byte blake2b digest of everything in the sidecar buffer following the header. '''
+    return hashlib.blake2b(memoryview(buffer)[_HEADER.size:],digest_size=16).digest()
+
+
+def sidecar_path(file: str) -> Path: return Path(file).with_suffix(SUFFIX)
+
+
+def _aligned(offset: int) -> int: return -(-offset//_ALIGNMENT)*_ALIGNMENT
+
+
+def _layout(rows: int) -> Tuple[int,int,int]:
+    ''' Return the offsets of the coordinates, text offsets and path sections for a sidecar with the given sizes. '''
+    coordinates_offset = _aligned(_HEADER.size)
+    text_offsets_offset = _aligned(coordinates_offset + rows*COLUMNS*4)
+    path_offset = text_offsets_offset + (rows+1)*8
+    return coordinates_offset, text_offsets_offset, path_offset
+
+
+def load(file: str) -> Tuple[str,np.ndarray,np.ndarray]|None:
+    ''' 
+    Return the text buffer, text offsets and coordinates cached for the box file, 
+    or None if there is no valid sidecar for its current contents.
+    '''
+    try:
+        with open(sidecar_path(file),mode='rb') as f: 
+            buffer = bytearray(os.fstat(f.fileno()).st_size)
+            f.readinto(buffer)
+        magic, version, size, mtime, digest, rows, path_length, text_length, payload_digest = _HEADER.unpack_from(buffer)
+        if (magic, version) != (MAGIC, VERSION): return None
+        coordinates_offset, text_offsets_offset, path_offset = _layout(rows)
+        text_offset = path_offset + path_length
+        if len(buffer) != text_offset + text_length: return None
+        if payload_digest != _payload_digest(buffer): return None
+        path = bytes(buffer[path_offset:text_offset])
+        if CacheKey(path,size,mtime,digest) != CacheKey.of(file): return None
+        coordinates = np.frombuffer(buffer,np.int32,rows*COLUMNS,coordinates_offset).reshape(rows,COLUMNS)
+        text_offsets = np.frombuffer(buffer,np.int64,rows+1,text_offsets_offset)
+        text_buffer = buffer[text_offset:].decode('utf-8')
+    except (OSError, struct.error, ValueError): 
+        return None
+    return text_buffer, text_offsets, coordinates
+
+
+def save(file: str, text_buffer: str, text_offsets: np.ndarray, coordinates: np.ndarray):
+    ''' Write the parsed contents of the box file to its sidecar. Failing to write it is not an error. '''
+    try:
+        key = CacheKey.of(file)
+        rows = len(coordinates)
+        text = text_buffer.encode('utf-8')
+        coordinates_offset, text_offsets_offset, path_offset = _layout(rows)
+        buffer = bytearray(path_offset + len(key.path) + len(text))
+        buffer[coordinates_offset:coordinates_offset+rows*COLUMNS*4] = np.ascontiguousarray(coordinates,np.int32).tobytes()
+        buffer[text_offsets_offset:path_offset] = np.ascontiguousarray(text_offsets,np.int64).tobytes()
+        buffer[path_offset:] = key.path + text
+        _HEADER.pack_into(buffer,0,MAGIC,VERSION,key.size,key.mtime,key.digest,rows,len(key.path),len(text),_payload_digest(buffer))
+        temporary_path = sidecar_path(file).with_suffix(f'{SUFFIX}.tmp')
+        temporary_path.write_bytes(buffer)
+        os.replace(temporary_path,sidecar_path(file))
+    except OSError:
+        pass
@@ -0,0 +1,79 @@
+#
+#    HyperKyube: OCR Gui MultiTool.
+#
+#    Copyright 2022 Daniel Gesua
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#   
+
+'''
+Module responsible for writing box files safely in a background thread, so saving never blocks the Tk 
+event loop and a crash in the middle of a save never leaves a truncated box file behind.
+
+The contents are written to a temporary file next to the box file, which is flushed to disk and then 
+moved over the box file with os.replace, so the box file always holds either the old or the new contents 
+in full. Flushing to disk (fsync) can be turned off with the HYPERKYUBE_FSYNC environment variable set to 
+0, trading durability against power loss for speed. Writes run one at a time in the order they were 
+requested, so an older save never overwrites a newer one.
+'''
+
+from __future__ import annotations
+
+
+import os
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+FSYNC_VARIABLE = 'HYPERKYUBE_FSYNC'
+
+
+def fsync_enabled() -> bool: return os.environ.get(FSYNC_VARIABLE,'1') != '0'
+
+
+def write_atomically(path: Path, data: bytes, fsync: bool = True):
+    ''' 
+    Replace the contents of the file with the data through a temporary file, flushing both the file 
+    and (where supported) its directory to disk first if fsync is set.
+    '''
+    path = Path(path)
+    temporary_path = path.with_name(f'.{path.name}.tmp')
+    try:
+        with open(temporary_path,mode='wb') as temporary_file:
+            temporary_file.write(data)
+            if fsync:
+                temporary_file.flush()
+                os.fsync(temporary_file.fileno())
+        os.replace(temporary_path,path)
+    finally:
+        temporary_path.unlink(missing_ok=True)
+    if fsync and hasattr(os,'O_DIRECTORY'):
+        directory = os.open(path.parent,os.O_RDONLY|os.O_DIRECTORY)
+        try: os.fsync(directory)
+        finally: os.close(directory)
+
+
+class BoxFileWriter():
+    ''' Writes box files atomically, one at a time, in a background thread. '''
+
+    def write(self, path: Path, text: str) -> Future:
+        ''' Start writing the text to the file and return the future of the write. '''
+        return self.pool.submit(write_atomically,path,text.encode('utf-8'),self.fsync)
+
+    def shutdown(self): 
+        ''' Wait for the pending writes to finish, so quitting never loses a save. '''
+        self.pool.shutdown(wait=True)
+
+    def __init__(self, fsync: bool = None) -> None:
+        self.fsync = fsync_enabled() if fsync is None else fsync
+        self.pool = ThreadPoolExecutor(max_workers=1,thread_name_prefix='box-writer')
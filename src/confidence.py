@@ -0,0 +1,213 @@
+#
+#    HyperKyube: OCR Gui MultiTool.
+#
+#    Copyright 2022 Daniel Gesua
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#   
+
+'''
+Confidence statistics engine. Tesseract's TSV output is parsed into NumPy columns, the recognized words 
+are joined to the wordboxes of a box file by geometry, and histograms and percentiles of the confidences 
+are computed per page and for a whole corpus, all vectorized over the columns.
+
+The statistics of every image in a directory tree can be computed from the command line:
+
+    python confidence.py <directory> [--jobs N] [--lang eng] [--worst 10]
+'''
+
+from __future__ import annotations
+
+
+import os
+import sys
+import colorsys
+import argparse
+import numpy as np
+
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Tuple
+
+from parsing import BoxStore, COLUMN_INDEX
+from startup import lazy_import
+
+batch_lstmbox = lazy_import('batch_lstmbox')
+tesseract_automation = lazy_import('tesseract_automation')
+process = lazy_import('concurrent.futures.process') # Only the command line tool uses multiprocessing.
+
+WORD_LEVEL = 5
+TSV_FIELDS = 12
+LEVEL, PAGE, LEFT, TOP, WIDTH, HEIGHT, CONF = 0, 1, 6, 7, 8, 9, 10 # Indices of the TSV fields that are read.
+NUMERIC_FIELDS = (PAGE,LEFT,TOP,WIDTH,HEIGHT,CONF,)
+HISTOGRAM_BINS = np.linspace(0,100,11)
+PERCENTILES = (5,25,50,75,95,)
+JOIN_CHUNK = 4096 # Words of a page joined to its boxes at a time, to bound the size of the containment matrix.
+NO_CONFIDENCE_COLOR = 'gray'
+
+
+class TsvWords(NamedTuple):
+    ''' 
+    The words of a TSV output as columns. Pages are zero based, and the edges are in image coordinates 
+    with the origin at the top left, as tesseract reports them.
+    '''
+    page: np.ndarray
+    left: np.ndarray
+    top: np.ndarray
+    right: np.ndarray
+    bottom: np.ndarray
+    conf: np.ndarray
+    text: List[str]
+
+    @classmethod
+    def concatenate(cls: TsvWords, parts: List[TsvWords]) -> TsvWords:
+        ''' Return the words of all the parts, in order. '''
+        columns = [np.concatenate([getattr(part,name) for part in parts]) for name in cls._fields[:-1]]
+        return cls(*columns,[text for part in parts for text in part.text])
+
+
+class Summary(NamedTuple):
+    ''' Aggregated confidences: how many there are, their mean, percentiles and histogram. '''
+    count: int
+    mean: float
+    percentiles: Dict[int,float]
+    histogram: np.ndarray
+
+
+def parse_tsv(data: bytes) -> TsvWords:
+    ''' 
+    Parse the recognized words of tesseract's TSV output into columns, skipping the empty ones. Only the text 
+    is split off in Python; all the numeric fields are parsed at once by NumPy.
+    '''
+    lines = data.decode('utf-8',errors='replace').splitlines()[1:]
+    split = [line.rsplit('\t',1) for line in lines if line.count('\t') == TSV_FIELDS - 1]
+    numbers = np.fromstring('\t'.join(fields for fields,_ in split),dtype=np.float64,sep='\t') if split else np.empty(0)
+    numbers = numbers.reshape(-1,TSV_FIELDS - 1)
+    texts = [text.strip() for _,text in split]
+    words = np.flatnonzero((numbers[:,LEVEL] == WORD_LEVEL) & np.array([bool(text) for text in texts],dtype=bool))
+    page, left, top, width, height, conf = numbers[words][:,NUMERIC_FIELDS].T
+    return TsvWords(page.astype(np.int32) - 1,left,top,left + width,top + height,conf,[texts[word] for word in words.tolist()])
+
+
+def group_by(keys: np.ndarray) -> Dict[int,np.ndarray]:
+    ''' Return the indices of the elements with every key, grouping them with a single sort. '''
+    order = np.argsort(keys,kind='stable')
+    unique_keys, starts = np.unique(keys[order],return_index=True)
+    return dict(zip(unique_keys.tolist(),np.split(order,starts[1:])))
+
+
+def join_confidences(store: BoxStore, words: TsvWords, heights: Dict[int,int]) -> Tuple[np.ndarray,np.ndarray]:
+    ''' 
+    Join the words to the boxes of the store whose area contains their centers, on the same page, and return 
+    the lowest and mean confidence of the words of every row of the store (NaN for rows without words).
+    The heights of the pages are needed to flip the words to the bottom left origin of box files.
+    Boxes and words are grouped by page first, so the containment matrices only span a single page.
+    '''
+    coordinates = store.coordinates
+    rows = len(coordinates)
+    lowest, total, count = np.full(rows,np.inf), np.zeros(rows), np.zeros(rows)
+    page_heights = np.array([heights.get(page,0) for page in words.page.tolist()],dtype=np.float64)
+    center_x, center_y = (words.left + words.right)/2, page_heights - (words.top + words.bottom)/2
+    page_rows = group_by(coordinates[:,COLUMN_INDEX['page']])
+    for page,page_words in group_by(words.page).items():
+        if (box_rows := page_rows.get(page)) is None: continue
+        page_coordinates = coordinates[box_rows]
+        left, bottom, right, top = (page_coordinates[:,COLUMN_INDEX[name],None] for name in ['left','bottom','right','top'])
+        for start in range(0,len(page_words),JOIN_CHUNK):
+            chunk = page_words[start:start + JOIN_CHUNK]
+            x, y = center_x[None,chunk], center_y[None,chunk]
+            box_indices, word_indices = np.nonzero((left <= x) & (x <= right) & (bottom <= y) & (y <= top))
+            confidences = words.conf[chunk][word_indices]
+            np.minimum.at(lowest,box_rows[box_indices],confidences)
+            np.add.at(total,box_rows[box_indices],confidences)
+            np.add.at(count,box_rows[box_indices],1)
+    with np.errstate(invalid='ignore',divide='ignore'): mean = total/count
+    lowest[count == 0] = np.nan
+    return lowest, mean
+
+
+def summarize(confidences: np.ndarray) -> Summary:
+    ''' Return the summary of the confidences, ignoring NaNs. '''
+    confidences = confidences[~np.isnan(confidences)]
+    histogram = np.histogram(confidences,bins=HISTOGRAM_BINS)[0]
+    if not len(confidences): return Summary(0,np.nan,{percentile: np.nan for percentile in PERCENTILES},histogram)
+    values = np.percentile(confidences,PERCENTILES)
+    return Summary(len(confidences),float(confidences.mean()),dict(zip(PERCENTILES,values.tolist())),histogram)
+
+
+def summarize_pages(words: TsvWords, keys: np.ndarray = None) -> Dict[int,Summary]:
+    ''' Return the summary of the confidences of the words of every page, grouping them with a single sort. '''
+    keys = words.page if keys is None else keys
+    return {key: summarize(words.conf[indices]) for key,indices in group_by(keys).items()}
+
+
+def confidence_color(confidence: float) -> str:
+    ''' Return the color of a confidence, from purple for 0 to green for 100, or gray if it's unknown. '''
+    if confidence is None or np.isnan(confidence): return NO_CONFIDENCE_COLOR
+    hue = 0.8 - 0.47*min(max(confidence,0.0),100.0)/100
+    return '#{:02x}{:02x}{:02x}'.format(*(int(channel*255) for channel in colorsys.hsv_to_rgb(hue,1.0,0.85)))
+
+
+def format_summary(label: str, summary: Summary) -> str:
+    ''' Return a line describing the summary. '''
+    percentiles = ' '.join(f'p{percentile}={value:.0f}' for percentile,value in summary.percentiles.items())
+    return f'{label}: {summary.count} words, mean {summary.mean:.1f}, {percentiles}'
+
+
+def format_histogram(summary: Summary, width: int = 40) -> str:
+    ''' Return a text histogram of the summary, one line per bin. '''
+    peak = max(int(summary.histogram.max()),1)
+    edges = HISTOGRAM_BINS.astype(int).tolist()
+    return '\n'.join(f'{edges[index]:>3}-{edges[index + 1]:<3} {"#"*(count*width//peak)} {count}' 
+        for index,count in enumerate(summary.histogram.tolist()))
+
+
+def image_words(img_path: Path, lang: str) -> TsvWords:
+    ''' Return the words tesseract recognizes in the image, from the tesseract output cache if possible. '''
+    return parse_tsv(tesseract_automation.make_tsv(str(img_path),lang))
+
+
+def corpus_statistics(directory: str, jobs: int = None, lang: str = 'eng', worst: int = 10) -> Summary:
+    ''' 
+    Print the confidence statistics of all the images in the directory tree: the corpus summary and histogram, 
+    and the pages with the lowest median confidence. Images are recognized in parallel, or read from the cache.
+    '''
+    images = batch_lstmbox.find_images(Path(directory))
+    if not images: 
+        print('No images were found.')
+        return summarize(np.empty(0))
+    with process.ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        parts = list(pool.map(image_words,images,[lang]*len(images)))
+    words = TsvWords.concatenate(parts)
+    document = np.repeat(np.arange(len(parts)),[len(part.conf) for part in parts])
+    corpus = summarize(words.conf)
+    print(format_summary(f'{len(images)} image(s)',corpus))
+    print(format_histogram(corpus))
+    pages = summarize_pages(words,document.astype(np.int64)*2**20 + words.page)
+    for key in sorted(pages,key=lambda key: pages[key].percentiles[50])[:worst]:
+        print(format_summary(f'{images[key >> 20]} page {(key & (2**20 - 1)) + 1}',pages[key]))
+    return corpus
+
+
+def main(arguments: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Compute the confidence statistics of every tiff image in a directory tree.')
+    parser.add_argument('directory',help='root of the directory tree containing the images')
+    parser.add_argument('-j','--jobs',type=int,default=None,help='number of worker processes (default: one per CPU)')
+    parser.add_argument('-l','--lang',default='eng',help='tesseract language to recognize the images with')
+    parser.add_argument('--worst',type=int,default=10,help='number of pages with the lowest median confidence to list')
+    args = parser.parse_args(arguments)
+    corpus_statistics(args.directory,args.jobs,args.lang,args.worst)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
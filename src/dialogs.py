@@ -23,15 +23,26 @@ with the user and [optionally] return the user's response.
 
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+from collections import Counter
+from typing import TYPE_CHECKING, Dict, List
 
 
+import tkinter
+
 from tkinter import messagebox
-from tkinter.simpledialog import askstring
+from tkinter.simpledialog import Dialog, askstring
 from tkinter.filedialog import askopenfilename
 
+from confidence import format_histogram, format_summary
+
 
-if TYPE_CHECKING: from rendered_geometry import WordBox
+if TYPE_CHECKING: 
+    from pathlib import Path
+    from rendered_geometry import WordBox
+    from validation import Issue
+    from tesseract_jobs import Job
+    from ocr_backends import Candidate
+    from confidence import Summary
 
 
 def display_invalid_value_error():
@@ -43,15 +54,104 @@ def display_invalid_value_error():
     error_message = 'A value is mandatory. Please enter a new value.'
     messagebox.showinfo(window_title,error_message)
 
-def prompt_for_wordbox_text(wordbox: WordBox) -> str|None:
+class CandidateDialog(Dialog):
+    ''' Text editor dialog that also lists candidate texts, filling the entry with the one that's selected. '''
+
+    def body(self, master: tkinter.Frame) -> tkinter.Entry:
+        ''' Lay out the entry and the list of candidates, and return the entry so it gets the focus. '''
+        tkinter.Label(master,text='Value:',justify=tkinter.LEFT).grid(row=0,sticky=tkinter.W)
+        self.entry = tkinter.Entry(master,width=50)
+        self.entry.insert(0,self.candidates[0].text)
+        self.entry.grid(row=1,sticky=tkinter.EW)
+        tkinter.Label(master,text='Candidates:',justify=tkinter.LEFT).grid(row=2,sticky=tkinter.W)
+        self.listbox = tkinter.Listbox(master,height=min(len(self.candidates),8),exportselection=False)
+        for candidate in self.candidates: self.listbox.insert(tkinter.END,f'{candidate.text}    ({candidate.confidence:.0f}%)')
+        self.listbox.insert(tkinter.END,f'{self.current_text}    (current)')
+        self.listbox.grid(row=3,sticky=tkinter.EW)
+        self.listbox.bind('<<ListboxSelect>>',self.fill_entry)
+        self.listbox.bind('<Double-Button-1>',self.ok)
+        return self.entry
+
+    def fill_entry(self, event: tkinter.Event = None):
+        ''' Replace the text of the entry with the selected candidate. '''
+        if not (selection := self.listbox.curselection()): return
+        texts = [candidate.text for candidate in self.candidates] + [self.current_text]
+        self.entry.delete(0,tkinter.END)
+        self.entry.insert(0,texts[selection[0]])
+
+    def apply(self): self.result = self.entry.get()
+
+    def __init__(self, title: str, candidates: List[Candidate], current_text: str) -> None:
+        self.candidates = candidates
+        self.current_text = current_text
+        super().__init__(tkinter._default_root,title)
+
+
+def prompt_for_wordbox_text(wordbox: WordBox, candidates: List[Candidate] = ()) -> str|None:
     '''
     Text Editor Text Input:
-    Request text from user and return it.
+    Request text from user and return it. If there are candidate texts, like those re-recognized
+    by tesseract, let the user pick one of them, starting with the most confident.
     '''
     window_title = 'Edit text.'
+    if candidates: return CandidateDialog(window_title,list(candidates),wordbox.core.text).result
     prompt = 'Value:' + '\t'*10
     return askstring(window_title,prompt,initialvalue=wordbox.core.text)
 
+def display_no_candidates_error():
+    '''
+    Re-OCR Error:
+    Let the user know tesseract didn't recognize any text in the selected wordbox.
+    '''
+    window_title = 'Error.'
+    messagebox.showinfo(window_title,'No text was recognized in the selected box.')
+
+def prompt_to_recover_edits(count: int) -> bool:
+    '''
+    Recover Edits Dialog:
+    Ask the user whether to reapply the unsaved edits found in the journal of the box file being opened.
+    '''
+    window_title = 'Recover edits.'
+    message = f'{count} unsaved edit(s) of this box file were found, probably from a session that ended unexpectedly.\n\nRecover them?'
+    return messagebox.askyesno(window_title,message)
+
+def display_validation_report(issues: List[Issue]):
+    '''
+    Validation Report:
+    Summarize the issues found while validating the box file.
+    '''
+    window_title = 'Validation report.'
+    if not issues: return messagebox.showinfo(window_title,'No issues were found.')
+    counts = Counter(issue.kind for issue in issues)
+    summary = '\n'.join(f'{kind}: {count}' for kind,count in sorted(counts.items()))
+    messagebox.showwarning(window_title,f'{len(issues)} issue(s) were found:\n\n{summary}\n\nThe boxes are highlighted in orange.')
+
+def display_confidence_report(document: Summary, pages: Dict[int,Summary]):
+    '''
+    Confidence Report:
+    Summarize the confidences of the words tesseract recognized in the document and in each of its pages.
+    '''
+    window_title = 'Confidence report.'
+    page_lines = '\n'.join(format_summary(f'Page {page + 1}',summary) for page,summary in sorted(pages.items()))
+    message = f'{format_summary("Document",document)}\n\n{format_histogram(document,width=20)}\n\n{page_lines}'
+    messagebox.showinfo(window_title,f'{message}\n\nThe boxes are colored from purple (low confidence) to green (high).')
+
+def display_job_error(job: Job):
+    '''
+    Job Error:
+    Let the user know a background tesseract job failed, and why.
+    '''
+    window_title = 'Error.'
+    messagebox.showerror(window_title,f'{job.description} failed:\n\n{job.error}')
+
+def display_save_error(path: Path, error: Exception):
+    '''
+    Save Error:
+    Let the user know the box file couldn't be saved, and why. The file on disk is left as it was.
+    '''
+    window_title = 'Error.'
+    messagebox.showerror(window_title,f'{path.name} could not be saved:\n\n{error}\n\nThe file was left unchanged.')
+
 def prompt_for_boxfile_to_open() -> str:
     ''' 
     Open Box File Dialog:
@@ -0,0 +1,207 @@
+#
+#    HyperKyube: OCR Gui MultiTool.
+#
+#    Copyright 2022 Daniel Gesua
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#   
+
+'''
+Module responsible for loading documents (box files together with their corresponding images),
+and for prefetching the documents next to the one being reviewed in a background thread pool.
+
+Prefetching decodes the first page of the image, renders the tiles of its first screen, and parses
+the box file ahead of time, keeping the results in a memory-bounded cache. That way moving on to the 
+next document of a training set is effectively instant instead of blocking the Tk main loop.
+'''
+
+from __future__ import annotations
+
+
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, List, Tuple
+from PIL import Image
+
+from parsing import BoxStore, open_lazily
+from tile_pyramid import TilePyramid
+
+if TYPE_CHECKING: 
+    from rendered_geometry import WordBoxes
+    from journal import EditJournal
+
+PREFETCH_MEMORY_BUDGET = 512*2**20 # Bytes.
+QUALITY_RESAMPLING = Image.BICUBIC
+
+
+def convert_to_rgb(bw_img: Image.Image) -> Image.Image:
+    ''' Convert a black and white image into a color image. '''
+    color_image = Image.new('RGB',bw_img.size)
+    color_image.paste(bw_img)
+    return color_image
+
+
+def find_corresponding_image(file_path: Path) -> str:
+    ''' Find the first image that corresponds to this box file and return its path.'''
+    directory = file_path.parent
+    glob_pattern = f'{file_path.stem}.tif*'
+    match = map(str,directory.glob(glob_pattern))
+    return next(match)
+
+
+def sibling_documents(box_path: Path) -> List[Path]:
+    ''' Return the paths of all the box files in the same directory as the box file, in order. '''
+    return sorted(box_path.parent.glob('*.box'))
+
+
+class PageImages():
+    ''' 
+    Lazily decodes the frames of a (potentially multi-page) image file. Only the frame of the current 
+    page and those of its neighbours are kept decoded, so large documents cost about as much as one page.
+    '''
+
+    def __init__(self, img_path: str, neighbours: int = 1):
+        self.file = Image.open(img_path)
+        self.page_count: int = getattr(self.file,'n_frames',1)
+        self.neighbours = neighbours
+        self._decoded: Dict[int,Image.Image] = {}
+
+    def __getitem__(self, page: int) -> Image.Image:
+        ''' Return the decoded frame of the page, and forget the frames that are no longer neighbours. '''
+        if page not in self._decoded:
+            self.file.seek(page)
+            self._decoded[page] = convert_to_rgb(self.file)
+        self._decoded = {key: frame for key,frame in self._decoded.items() if abs(key - page) <= self.neighbours}
+        return self._decoded[page]
+
+    @property
+    def nbytes(self) -> int: return sum(len(frame.getbands())*frame.width*frame.height for frame in self._decoded.values())
+
+    def close(self): self.file.close()
+
+
+class Document():
+    ''' A box file along with its corresponding image, loaded and ready to be displayed. '''
+
+    @classmethod
+    def load(cls: Document, box_path: Path, viewport_size: Tuple[int,int] = None) -> Document:
+        ''' 
+        Load the box file and its image, parsing and decoding only their first page. If the size of the viewport is given,
+        also render the tiles of the first screen at the scale that fits the page in it.
+        '''
+        box_path = Path(box_path).with_suffix('.box')
+        document = cls(box_path,PageImages(find_corresponding_image(box_path)),open_lazily(str(box_path)))
+        if viewport_size:
+            pyramid = document.pyramid(0)
+            scale = viewport_size[1]/pyramid.image.height
+            for column,row in pyramid.tiles_in(scale,(0,0,*viewport_size)): pyramid.tile(scale,column,row,QUALITY_RESAMPLING)
+        return document
+
+    def pyramid(self, page: int) -> TilePyramid:
+        ''' Return the tile pyramid of the page, keeping only the one of the last page requested. '''
+        if self._pyramid_page != page: self._pyramid, self._pyramid_page = TilePyramid(self.page_images[page]), page
+        return self._pyramid
+
+    @property
+    def has_unsaved_edits(self) -> bool: return self.boxes is not None and self.boxes.modified
+
+    @property
+    def is_stale(self) -> bool: 
+        ''' Return whether the box file was modified on disk after it was loaded. '''
+        return not self.box_path.exists() or self.box_path.stat().st_mtime_ns != self.mtime
+
+    @property
+    def nbytes(self) -> int:
+        ''' Return an estimate of the memory used by the decoded images, rendered tiles and parsed boxes. '''
+        pyramid_bytes = 0
+        if self._pyramid is not None:
+            images = [*self._pyramid.levels[1:],*self._pyramid.tiles.values()]
+            pyramid_bytes = sum(len(image.getbands())*image.width*image.height for image in images)
+        return self.page_images.nbytes + pyramid_bytes + self.store.coordinates.nbytes + len(self.store.text_buffer)
+
+    def close(self): 
+        self.page_images.close()
+        if self.journal is not None: self.journal.close()
+        if self.boxes is not None: self.boxes.close()
+        self.store.stop_loading()
+
+    def __init__(self, box_path: Path, page_images: PageImages, store: BoxStore) -> None:
+        self.box_path = box_path
+        self.mtime = box_path.stat().st_mtime_ns
+        self.page_images = page_images
+        self.store = store
+        self.boxes: WordBoxes = None
+        self.journal: EditJournal = None
+        self._pyramid: TilePyramid = None
+        self._pyramid_page: int = None
+
+
+class DocumentPrefetcher():
+    ''' Loads documents in a background thread pool and keeps them in a memory-bounded LRU cache. '''
+
+    def prefetch(self, box_paths: Iterable[Path], viewport_size: Tuple[int,int] = None):
+        ''' Start loading the documents that are neither cached nor already being loaded. '''
+        for box_path in box_paths:
+            if box_path in self.documents or box_path in self.pending: continue
+            self.pending[box_path] = self.pool.submit(Document.load,box_path,viewport_size)
+
+    def take(self, box_path: Path) -> Document|None:
+        ''' 
+        Remove the document from the cache and return it, waiting for it if it's still being loaded. 
+        Return None if it wasn't prefetched, it failed to load or it changed on disk since, 
+        unless it has unsaved edits, which are never discarded.
+        '''
+        self.collect()
+        document = None
+        if box_path in self.pending:
+            future = self.pending.pop(box_path)
+            document = None if future.exception() else future.result()
+        elif box_path in self.documents:
+            document = self.documents.pop(box_path)
+        if document is not None and document.is_stale and not document.has_unsaved_edits: 
+            document.close()
+            document = None
+        return document
+
+    def keep(self, document: Document):
+        ''' Put a document back in the cache, like the one that was just navigated away from. '''
+        self.documents[document.box_path] = document
+        self.evict()
+
+    def collect(self):
+        ''' Move the documents that finished loading into the cache, discarding those that failed. '''
+        for box_path,future in [item for item in self.pending.items() if item[1].done()]:
+            del self.pending[box_path]
+            if not future.exception(): self.keep(future.result())
+
+    def evict(self):
+        ''' 
+        Close and drop the least recently cached documents until the cache fits the memory budget. 
+        Documents with unsaved edits are pinned, and stay cached however much memory they use.
+        '''
+        evictable = [box_path for box_path,document in self.documents.items() if not document.has_unsaved_edits]
+        total = sum(document.nbytes for document in self.documents.values())
+        for box_path in evictable:
+            if len(self.documents) <= 1 or total <= self.memory_budget: break
+            document = self.documents.pop(box_path)
+            total -= document.nbytes
+            document.close()
+
+    def shutdown(self): self.pool.shutdown(wait=False,cancel_futures=True)
+
+    def __init__(self, max_workers: int = 2, memory_budget: int = PREFETCH_MEMORY_BUDGET) -> None:
+        self.pool = ThreadPoolExecutor(max_workers=max_workers,thread_name_prefix='prefetch')
+        self.memory_budget = memory_budget
+        self.pending: Dict[Path,Future] = {}
+        self.documents: OrderedDict[Path,Document] = OrderedDict()
@@ -0,0 +1,135 @@
+#
+#    HyperKyube: OCR Gui MultiTool.
+#
+#    Copyright 2022 Daniel Gesua
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#   
+
+'''
+Module responsible for undoing and redoing the edits made to the wordboxes.
+
+Rather than snapshots of the boxes, the history stores small deltas: the row of the box along with its 
+edges or text before and after the edit, or just the row of a created or deleted box (whose row is never 
+reused, so it can be brought back as it was). Deltas recorded while a group is open, like all the motions 
+of a drag gesture, make up a single entry, and the edge deltas of the same box are merged into one. The 
+number of entries is bounded, so the memory used stays small however long the editing session.
+'''
+
+from __future__ import annotations
+
+
+from collections import deque
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Deque, Dict, Iterator, List, NamedTuple, Tuple, Union
+
+if TYPE_CHECKING: from rendered_geometry import WordBoxes
+
+HISTORY_LENGTH = 1000
+
+Edges = Tuple[int,int,int,int]
+
+
+class EdgesDelta(NamedTuple):
+    ''' The (left, bottom, right, top) edges of the box in the row before and after they were moved. '''
+    row: int
+    old: Edges
+    new: Edges
+
+    def apply(self, boxes: WordBoxes, undo: bool): boxes.store.set_coordinates(self.row,*(self.old if undo else self.new))
+
+
+class TextDelta(NamedTuple):
+    ''' The text of the box in the row before and after it was edited. '''
+    row: int
+    old: str
+    new: str
+
+    def apply(self, boxes: WordBoxes, undo: bool): boxes.store.set_text(self.row,self.old if undo else self.new)
+
+
+class CreateDelta(NamedTuple):
+    ''' The creation of the box in the row. '''
+    row: int
+
+    def apply(self, boxes: WordBoxes, undo: bool): 
+        if undo: boxes.delete(boxes.by_row[self.row])
+        else: boxes.restore(self.row)
+
+
+class DeleteDelta(NamedTuple):
+    ''' The deletion of the box in the row. '''
+    row: int
+
+    def apply(self, boxes: WordBoxes, undo: bool): CreateDelta(self.row).apply(boxes,not undo)
+
+
+Delta = Union[EdgesDelta,TextDelta,CreateDelta,DeleteDelta]
+
+
+class EditHistory():
+    ''' The bounded stacks of the entries that can be undone and redone, each made of one or more deltas. '''
+
+    def edges(self, row: int) -> Edges: 
+        ''' Return the current (left, bottom, right, top) edges of the box in the row. '''
+        return tuple(self.boxes.store.coordinates[row,:4].tolist())
+
+    def record(self, delta: Delta):
+        ''' Record a delta as a new entry, or as part of the open group, and forget the entries that were undone. '''
+        if self.group is None: self.undo_stack.append([delta])
+        elif isinstance(delta,EdgesDelta) and (previous := self.group_edges.get(delta.row)) is not None:
+            self.group[previous] = delta._replace(old=self.group[previous].old)
+        else:
+            if isinstance(delta,EdgesDelta): self.group_edges[delta.row] = len(self.group)
+            self.group.append(delta)
+        self.redo_stack.clear()
+
+    def begin_group(self): 
+        ''' Start recording the deltas as a single entry, like for the duration of a drag gesture. '''
+        self.group, self.group_edges = [], {}
+
+    def end_group(self):
+        ''' Finish the entry being recorded, leaving out edges that ended where they started. '''
+        group = [delta for delta in self.group or () if not (isinstance(delta,EdgesDelta) and delta.old == delta.new)]
+        self.group, self.group_edges = None, {}
+        if group: self.undo_stack.append(group)
+
+    @contextmanager
+    def grouped(self) -> Iterator[None]:
+        ''' Record the deltas of the block as a single entry. '''
+        self.begin_group()
+        try: yield
+        finally: self.end_group()
+
+    def undo(self) -> bool:
+        ''' Revert the last entry and return whether there was one. '''
+        if not self.undo_stack: return False
+        entry = self.undo_stack.pop()
+        for delta in reversed(entry): delta.apply(self.boxes,undo=True)
+        self.redo_stack.append(entry)
+        return True
+
+    def redo(self) -> bool:
+        ''' Reapply the last entry undone and return whether there was one. '''
+        if not self.redo_stack: return False
+        entry = self.redo_stack.pop()
+        for delta in entry: delta.apply(self.boxes,undo=False)
+        self.undo_stack.append(entry)
+        return True
+
+    def __init__(self, boxes: WordBoxes, length: int = HISTORY_LENGTH) -> None:
+        self.boxes = boxes
+        self.undo_stack: Deque[List[Delta]] = deque(maxlen=length)
+        self.redo_stack: Deque[List[Delta]] = deque(maxlen=length)
+        self.group: List[Delta] = None
+        self.group_edges: Dict[int,int] = {}
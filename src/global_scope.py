@@ -31,8 +31,13 @@ For example:
 - "the.scale" refers to the scale factor used to convert from the image and file coordinates
   to the coordinates of the (potentially larger or smaller) canvas.
 
-- "the.buffered_image" refers to the image that is currently being processed to display on the
-  canvas.
+- "the.zoom" refers to the zoom factor applied on top of the scale that fits the image in the canvas.
+
+- "the.rendered_size" refers to the (width, height) of the whole image at the current scale, which
+  is the extent of the scrollable canvas.
+
+- "the.viewport" refers to the (left, top, right, bottom) region of the scaled image that is
+  currently visible on the canvas.
 
 - "the.boxes" refers to all the wordboxes parsed from the current boxfile.
 
@@ -47,10 +52,12 @@ For example:
 
 - "the.active_file_path" refers to a string containing the fully qualified path to the box
   file that's currently loaded.
+
+- "the.page" refers to the (zero based) number of the page of a multi-page image and box file
+  that is currently displayed.
 '''
 
-from typing import TYPE_CHECKING, Union
-from PIL import Image
+from typing import TYPE_CHECKING, Tuple, Union
 
 if TYPE_CHECKING: from rendered_geometry import NewWordBox, WordBox, WordBoxes, DragBox
 
@@ -66,12 +73,14 @@ class RealGlobalScope():
 
     def __init__(self) -> None:
         self.scale: float = 1.0
-        self.buffered_image: Image.Image = None
-        self.mirror_image: Image.Image = None
+        self.zoom: float = 1.0
+        self.rendered_size: Tuple[int,int] = (0,0,)
+        self.viewport: Tuple[int,int,int,int] = (0,0,0,0,)
         self.boxes: WordBoxes = None
         self.active_wordbox: Union[WordBox,NoActiveWordBox] = NoActiveWordBox()
         self.new_wordbox: NewWordBox = None
         self.active_dragbox: DragBox = None
         self.active_file_path: str = ''
+        self.page: int = 0
 
 real_global_scope = RealGlobalScope()
\ No newline at end of file
@@ -0,0 +1,81 @@
+#
+#    HyperKyube: OCR Gui MultiTool.
+#
+#    Copyright 2022 Daniel Gesua
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#   
+
+'''
+This module contains the window that lists the background tesseract jobs, showing the state,
+progress and elapsed time of each, and lets the user cancel them.
+'''
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+from gui_builder import builder
+
+import pathlib
+import tkinter
+import tkinter.ttk
+
+from tesseract_jobs import RUNNING, JobManager
+
+if TYPE_CHECKING: from tesseract_jobs import Job
+
+PROJECT_PATH = pathlib.Path(__file__).parent
+PROJECT_UI = PROJECT_PATH / "jobs.ui"
+
+
+class JobsWindow():
+    ''' Non-modal window that displays the jobs of the job manager, refreshed whenever the manager polls. '''
+
+    def row_values(self, job: Job) -> tuple:
+        ''' Return the description, state, progress and elapsed time of the job, as shown in its row. '''
+        progress = f'{job.progress:.0%}' if job.state == RUNNING or job.progress else ''
+        return (job.description,job.state,progress,f'{job.elapsed:.1f}s',)
+
+    def refresh(self):
+        ''' Add, update and remove the rows of the table so they match the jobs of the manager. '''
+        jobs = {str(job.id): job for job in self.manager.jobs}
+        for iid in set(self.tree.get_children()).difference(jobs): self.tree.delete(iid)
+        for iid,job in jobs.items():
+            if self.tree.exists(iid): self.tree.item(iid,values=self.row_values(job))
+            else: self.tree.insert('',tkinter.END,iid=iid,values=self.row_values(job))
+
+    def cancel_selected_jobs(self, event: tkinter.Event = None):
+        ''' Cancel the jobs selected in the table. '''
+        jobs = {str(job.id): job for job in self.manager.jobs}
+        for iid in self.tree.selection(): 
+            if iid in jobs: self.manager.cancel(jobs[iid])
+
+    def __init__(self, manager: JobManager, master:tkinter.Misc = None):
+        self.tk = tkinter
+        self.manager = manager
+        builder.add_resource_path(PROJECT_PATH)
+        builder.add_from_file(PROJECT_UI)
+        self.mainwindow: tkinter.Toplevel = builder.get_object('jobs_toplevel', master)
+        self.tree: tkinter.ttk.Treeview = builder.get_object('jobs_tree', master)
+        builder.connect_callbacks(self)
+        self.mainwindow.protocol('WM_DELETE_WINDOW',self.hide)
+        self.mainwindow.withdraw()
+        manager.listeners.append(self.refresh)
+
+    def show(self):
+        self.refresh()
+        self.mainwindow.deiconify()
+        self.mainwindow.lift()
+
+    def hide(self, event: tkinter.Event = None): 
+        self.mainwindow.withdraw()
@@ -0,0 +1,166 @@
+#
+#    HyperKyube: OCR Gui MultiTool.
+#
+#    Copyright 2022 Daniel Gesua
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#   
+
+'''
+Module responsible for the append-only journal of edits kept next to a box file (as a ".journal" file), 
+so a session of edits survives a crash without the whole box file having to be rewritten after every edit.
+
+Every mutation of the wordboxes (dragging an edge, creating, deleting or editing the text of a box, or 
+undoing one of these) is appended to the journal as one JSON line holding the new state of the box, so 
+logging an edit costs the same regardless of the size of the box file. The journal starts with a header identifying the exact 
+version of the box file the edits apply to. When a box file is opened with a journal for its current 
+version, its edits can be replayed on top of it, and saving the box file compacts the journal back to 
+just its header.
+'''
+
+from __future__ import annotations
+
+
+import os
+import json
+
+from pathlib import Path
+from typing import TYPE_CHECKING, List
+
+from box_cache import CacheKey
+from parsing import WordBoxCore
+
+if TYPE_CHECKING: from rendered_geometry import WordBoxes
+
+SUFFIX = '.journal'
+SET, ADD, DELETE, RESTORE = 'set', 'add', 'delete', 'restore'
+
+
+def journal_path(box_path: Path) -> Path: return Path(box_path).with_suffix(SUFFIX)
+
+
+class EditJournal():
+    ''' The journal of the edits made to the wordboxes of a box file since it was last saved. '''
+
+    def header(self) -> str:
+        ''' Return the header line identifying the current version of the box file. '''
+        key = CacheKey.of(self.box_path)
+        return json.dumps({'box': {'size': key.size,'mtime': key.mtime,'digest': key.digest.hex()}}) + '\n'
+
+    def pending_entries(self) -> List[list]:
+        ''' 
+        Return the edits in the journal if it was made for the current version of the box file, or an empty list 
+        if there's no journal or it belongs to another version. A line cut short by a crash ends the edits.
+        '''
+        try: 
+            with open(self.path,encoding='utf-8') as journal_file: lines = journal_file.readlines()
+        except OSError: return []
+        if not lines or lines[0] != self.header(): return []
+        entries = []
+        for line in lines[1:]:
+            try: entries.append(json.loads(line))
+            except json.JSONDecodeError: break
+        return entries
+
+    def replay(self, boxes: WordBoxes, entries: List[list]):
+        ''' Apply the edits of the entries to the wordboxes, in order, once all their pages are loaded. '''
+        boxes.load_pages()
+        store = boxes.store
+        for kind,row,*values in entries:
+            if kind == SET and row < len(store):
+                store.set_coordinates(row,*values[:4])
+                store.set_text(row,values[4])
+            elif kind == ADD and row == len(store):
+                left, bottom, right, top, page, text = values
+                boxes.add(WordBoxCore(text=text,left=left,top=top,right=right,bottom=bottom),page)
+            elif kind == DELETE and row in boxes.by_row:
+                boxes.delete(boxes.by_row[row])
+            elif kind == RESTORE and row < len(store) and row not in boxes.by_row:
+                boxes.restore(row)
+
+    def attach(self, boxes: WordBoxes, keep_entries: bool = False):
+        ''' 
+        Start journaling the edits of the wordboxes. The journal is started over for the current version of
+        the box file, unless the entries already in it were replayed and must be kept.
+        '''
+        self.boxes = boxes
+        if not keep_entries: self.compact()
+        self.open()
+        boxes.store.listeners.append(self.log_set)
+        boxes.journal = self
+
+    def write(self, entry: list): 
+        ''' Append the entry to the journal as a single line, which is written right away. '''
+        if self.file is None: return
+        self.written += self.file.write((json.dumps(entry,ensure_ascii=False) + '\n').encode('utf-8'))
+
+    def mark(self) -> int: 
+        ''' 
+        Return the position of the end of the journal, so the entries after it can be kept when compacting. 
+        Positions count the bytes of all the entries ever written, so they stay valid across compactions.
+        '''
+        return self.written
+
+    def log_set(self, row: int):
+        ''' Log the current edges and text of the box in the row, after any of them changed. '''
+        left, bottom, right, top, _ = self.boxes.store.coordinates[row].tolist()
+        self.write([SET,row,left,bottom,right,top,self.boxes.store.text(row)])
+
+    def log_add(self, row: int):
+        ''' Log the creation of the box in the row. '''
+        self.write([ADD,row,*self.boxes.store.coordinates[row].tolist(),self.boxes.store.text(row)])
+
+    def log_delete(self, row: int): self.write([DELETE,row])
+
+    def log_restore(self, row: int): self.write([RESTORE,row])
+
+    def compact(self, since: int = None):
+        ''' 
+        Start the journal over with the header of the current version of the box file, like after saving it.
+        The entries after the position marked by since, made while the box file was being saved, are kept.
+        A journal that was closed, like the one of a document closed while it was being saved, stays closed.
+        '''
+        was_open = self.file is not None
+        entries = b''
+        since = self.written if since is None else max(since,self.start)
+        if since < self.written and self.path.exists():
+            with open(self.path,mode='rb') as journal_file:
+                journal_file.seek(self.header_size + since - self.start)
+                entries = journal_file.read()
+        self.close()
+        header = self.header().encode('utf-8')
+        temporary_path = self.path.with_name(f'{self.path.name}.tmp')
+        temporary_path.write_bytes(header + entries)
+        os.replace(temporary_path,self.path)
+        self.header_size, self.start = len(header), since
+        if was_open: self.open()
+
+    def open(self):
+        ''' Open the journal for appending entries, unbuffered so every entry reaches the file at once. '''
+        self.file = open(self.path,mode='ab',buffering=0)
+        if not self.header_size:
+            with open(self.path,mode='rb') as journal_file: self.header_size = len(journal_file.readline())
+        self.written = self.start + self.file.seek(0,os.SEEK_END) - self.header_size
+
+    def close(self):
+        if self.file is not None: self.file.close()
+        self.file = None
+
+    def __init__(self, box_path: Path) -> None:
+        self.box_path = Path(box_path)
+        self.path = journal_path(box_path)
+        self.boxes: WordBoxes = None
+        self.file = None
+        self.header_size = 0 # Bytes of the header at the start of the file.
+        self.start = 0 # Position of the first entry in the file.
+        self.written = 0 # Position of the end of the last entry.
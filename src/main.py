@@ -24,23 +24,44 @@ user-triggered GUI events like clicks, keyboard strokes and prompts.
 from __future__ import annotations
 
 
+import sys
+
+from startup import PROFILE_FLAG, lazy_import, profiler
+if PROFILE_FLAG in sys.argv: profiler.start() # Before the other imports, so they are timed too.
+
 import pathlib
+import threading
 import tkinter
 
-from global_scope import real_global_scope as the
+from concurrent.futures import Future
+from functools import partial
+from typing import List, Tuple
+from global_scope import NoActiveWordBox, real_global_scope as the
 from gui_builder import builder
-from rendered_geometry import DragBox, NewWordBox, WordBoxes
-from parsing import parse
+from rendered_geometry import DragBox, NewWordBox, WordBox, WordBoxes
+from documents import Document, DocumentPrefetcher, sibling_documents
 from tooltips import WordBoxToolTip
 from about import AboutDialog
-from dialogs import prompt_for_boxfile_to_open, prompt_for_image_to_process
-from main_canvas import CanvasManager, with_refresh
+from dialogs import display_confidence_report, display_job_error, display_no_candidates_error, display_save_error, display_validation_report, prompt_for_boxfile_to_open, prompt_for_image_to_process, prompt_to_recover_edits
+from main_canvas import PLACEHOLDER_BOXFILE, ZOOM_STEP, CanvasManager, canvas_point, with_refresh
 from mirror_canvas import MirrorCanvas
-from tesseract_automation import make_lstmbox_file
+from render_scheduler import RenderScheduler
+from tesseract_jobs import DONE, FAILED, POLL_INTERVAL, Job, JobManager
+from jobs_window import JobsWindow
+from edit_history import DeleteDelta, EdgesDelta
+from journal import EditJournal
+from box_writer import BoxFileWriter
+from validation import image_sizes
+from confidence import join_confidences, parse_tsv, summarize, summarize_pages
+
+tesseract_automation = lazy_import('tesseract_automation')
+ocr_backends = lazy_import('ocr_backends')
 
 
 PROJECT_PATH = pathlib.Path(__file__).parent
 PROJECT_UI = PROJECT_PATH / "gui.ui"
+SHIFT_MASK = 0x0001
+CONTROL_MASK = 0x0004
 
 
 class GuiApp:
@@ -51,37 +72,141 @@ class GuiApp:
     @property
     def adjusting_dragbox(self) -> bool: return the.active_dragbox is not None
 
+    @property
+    def page_count(self) -> int: return self.canvas_manager.page_images.page_count
+
     def __init__(self, master=None): 
+        ''' 
+        Build the window and its components. The placeholder document is only shown once the window has 
+        been drawn, so the window appears without waiting for it to load, and the event handlers are only 
+        connected after that, since they all expect a document to be shown.
+        '''
         self.tk = tkinter
-        builder.add_resource_path(PROJECT_PATH)
-        builder.add_from_file(PROJECT_UI)
-        self.mainwindow: tkinter.Toplevel = builder.get_object('outer_window', master)
-        self.mainwindow.geometry(f'474x600')
-        self.canvas_manager = CanvasManager()
-        self.mirror_canvas = MirrorCanvas()
-        self.about_dialogue = AboutDialog()
-        self.tooltip = WordBoxToolTip(self.canvas_manager.canvas,'',0)
+        with profiler.step('Build the window'):
+            builder.add_resource_path(PROJECT_PATH)
+            builder.add_from_file(PROJECT_UI)
+            self.mainwindow: tkinter.Toplevel = builder.get_object('outer_window', master)
+            self.mainwindow.geometry(f'474x600')
+        with profiler.step('Create the canvases'):
+            self.render_scheduler = RenderScheduler(self)
+            self.canvas_manager = CanvasManager(self.render_scheduler)
+            self.mirror_canvas = MirrorCanvas()
+        with profiler.step('Create the dialogs and services'):
+            self.about_dialogue = AboutDialog()
+            self.tooltip = WordBoxToolTip(self.canvas_manager.canvas,'',0)
+            self.title = self.mainwindow.title()
+            self.prefetcher = DocumentPrefetcher()
+            self.job_manager = JobManager(self.mainwindow)
+            self.jobs_window = JobsWindow(self.job_manager)
+            self.box_writer = BoxFileWriter()
+            self.pending_saves: List[Tuple[Document,int|None,Future]] = []
+        # Idle callbacks queued while running one batch of them run in the next batch, after the window is drawn.
+        self.mainwindow.after_idle(self.mainwindow.after_idle,self.show_placeholder)
+    
+    def show_placeholder(self):
+        ''' Show the placeholder document and its first frame, which ends the startup, and start handling events. '''
+        with profiler.step('Load the placeholder'): 
+            self.canvas_manager.show_document(Document.load(PLACEHOLDER_BOXFILE))
         builder.connect_callbacks(self)
+        with profiler.step('Display the first frame'): 
+            self.render_scheduler.request()
+            self.render_scheduler.flush()
+        profiler.stop()
+        self.mainwindow.after_idle(self.warm_ocr_backend)
+
+    def warm_ocr_backend(self):
+        ''' Prepare the OCR backend in a background thread once the window is shown, so the first Re-OCR doesn't wait for it. '''
+        backend = ocr_backends.get_backend()
+        threading.Thread(target=backend.warm,args=('eng',),name='ocr-warmup',daemon=True).start()
     
     def run(self):
         self.mainwindow.mainloop()
 
     @with_refresh
     def load_boxfile(self, file_name: str):
-        ''' Load a box-file/image combination on the main canvas.'''
+        ''' 
+        Load a box-file/image combination on the main canvas. A document that is already open, shown or kept 
+        in the prefetch cache, is reused instead of being loaded again, unless it changed on disk and has no 
+        unsaved edits, so there's never more than one document journaling the edits of a box file.
+        '''
+        box_path = pathlib.Path(file_name).with_suffix('.box').resolve()
+        current = self.canvas_manager.document
+        if current is not None and current.box_path == box_path and (current.has_unsaved_edits or not current.is_stale): return
+        self.open_document(self.prefetcher.take(box_path) or Document.load(box_path))
+
+    def open_document(self, document: Document):
+        ''' 
+        Show the document, keeping the one being replaced in the prefetch cache along with its edits (or closing it
+        if it's an outdated version of the same box file), and start prefetching the documents before and after it in its directory.
+        '''
+        if (current := self.canvas_manager.document) is not None:
+            if current.box_path == document.box_path: current.close()
+            else: self.prefetcher.keep(current)
+        the.active_wordbox = NoActiveWordBox()
+        self.canvas_manager.show_document(document)
+        if document.journal is None: self.start_journal(document)
+        self.update_title()
+        self.prefetcher.prefetch(self.neighbouring_documents(),self.canvas_manager.viewport_size)
+
+    def start_journal(self, document: Document):
+        ''' 
+        Start journaling the edits of the document next to its box file, after offering to recover 
+        the unsaved edits left in the journal by a session that ended without saving.
+        '''
+        document.journal = EditJournal(document.box_path)
+        entries = document.journal.pending_entries()
+        recover = bool(entries) and prompt_to_recover_edits(len(entries))
+        if recover: document.journal.replay(document.boxes,entries)
+        document.journal.attach(document.boxes,keep_entries=recover)
+
+    def neighbouring_documents(self) -> List[pathlib.Path]:
+        ''' Return the paths of the box files after and before the current one in its directory. '''
+        box_path = self.canvas_manager.document.box_path
+        siblings = sibling_documents(box_path)
+        if box_path not in siblings: return []
+        index = siblings.index(box_path)
+        return [siblings[index + offset] for offset in (1,-1,) if 0 <= index + offset < len(siblings)]
+
+    def go_to_document(self, offset: int):
+        ''' Open the box file that's offset places away from the current one in its directory, if there is one. '''
+        box_path = self.canvas_manager.document.box_path
+        siblings = sibling_documents(box_path)
+        if box_path not in siblings: return
+        index = siblings.index(box_path) + offset
+        if 0 <= index < len(siblings): self.load_boxfile(siblings[index])
+
+    def next_document(self, event: tkinter.Event = None):
+        ''' Open the next box file in the directory of the current one. '''
+        self.go_to_document(1)
+
+    def previous_document(self, event: tkinter.Event = None):
+        ''' Open the previous box file in the directory of the current one. '''
+        self.go_to_document(-1)
+
+    def update_title(self):
+        ''' Show the current page number in the window title for multi-page documents. '''
+        page_info = f' - Page {the.page + 1}/{self.page_count}' if self.page_count > 1 else ''
+        self.mainwindow.title(f'{self.title}{page_info}')
+
+    def go_to_page(self, page: int):
+        ''' Display the page if it exists, deselecting the active wordbox and ending any gesture on the previous page. '''
+        if not 0 <= page < self.page_count: return
+        if self.adjusting_dragbox: the.boxes.history.end_group()
+        the.active_wordbox = NoActiveWordBox()
+        the.active_dragbox = None
+        the.new_wordbox = None
+        self.canvas_manager.show_page(page)
+        self.update_title()
 
-        def find_corresponding_image(file_path: pathlib.Path):
-            ''' Find the first image that corresponds to this box file and return its path.'''
-            directory = file_path.parent
-            glob_pattern = f'{file_path.stem}.tif*'
-            match = map(str,directory.glob(glob_pattern))
-            return next(match)   
+    @with_refresh
+    def next_page(self, event: tkinter.Event = None):
+        ''' Display the next page of a multi-page document. '''
+        self.go_to_page(the.page + 1)
 
-        file_path = pathlib.Path(file_name)
-        the.active_file_path = str(file_path.with_suffix('.box'))
-        img_file_path = find_corresponding_image(file_path)
-        self.canvas_manager.load_original_image(img_file_path)
-        the.boxes = WordBoxes(parse(the.active_file_path))
+    @with_refresh
+    def previous_page(self, event: tkinter.Event = None):
+        ''' Display the previous page of a multi-page document. '''
+        self.go_to_page(the.page - 1)
 
     def obtain_and_load_boxfile(self, event: tkinter.Event = None):
         ''' Load the boxfile provided by the user.'''
@@ -91,16 +216,75 @@ class GuiApp:
         '''
         Request an image from the user. If the user selects one then run Tesseract on it
         to make a boxfile and load it.
+        Tesseract runs in the background, and the jobs window shows its progress.
         '''
         if (file_name := prompt_for_image_to_process()): 
-            make_lstmbox_file(file_name)
-            self.load_boxfile(file_name)
-            
+            self.job_manager.submit(tesseract_automation.lstmbox_job(file_name,on_done=partial(self.finish_boxfile_job,file_name)))
+            self.show_jobs()
+
+    def finish_boxfile_job(self, file_name: str, job: Job):
+        ''' Load the boxfile made by a finished job, or report why it failed. '''
+        if job.state == DONE: self.load_boxfile(file_name)
+        elif job.state == FAILED: display_job_error(job)
+
+    def toggle_confidence_overlay(self, event: tkinter.Event = None):
+        ''' 
+        Hide the confidence overlay if it's shown. Otherwise get the confidences of the words of the image from 
+        tesseract in the background, then color the wordboxes by the confidence of the words they contain.
+        '''
+        if the.boxes.confidences is not None: 
+            the.boxes.set_confidences(None)
+            return self.render_scheduler.request()
+        img_path = self.canvas_manager.page_images.file.filename
+        self.job_manager.submit(tesseract_automation.tsv_job(img_path,on_done=partial(self.finish_confidence_job,img_path,the.boxes)))
+
+    @with_refresh
+    def finish_confidence_job(self, img_path: str, boxes: WordBoxes, job: Job):
+        ''' Join the recognized words to the wordboxes by geometry, show their confidences and report their statistics. '''
+        if job.state == FAILED: return display_job_error(job)
+        if job.state != DONE: return
+        words = parse_tsv(job.result)
+        heights = {page: size[1] for page,size in image_sizes(img_path).items()}
+        boxes.load_pages()
+        boxes.set_confidences(join_confidences(boxes.store,words,heights)[0])
+        if boxes is the.boxes: display_confidence_report(summarize(words.conf),summarize_pages(words))
+
+    def show_jobs(self, event: tkinter.Event = None):
+        ''' Show the window listing the background tesseract jobs. '''
+        self.jobs_window.show()
 
     def save_boxfile(self, event: tkinter.Event = None):
-        ''' Save the corrected wordbox data to the active file. '''
-        with open(file=the.active_file_path,mode='w') as box_file:
-            box_file.write(the.boxes.file_representation)
+        ''' 
+        Save the corrected wordbox data to the active file. The file is written atomically in the background, 
+        and the journal of the edits saved into it is compacted once it's done.
+        '''
+        document = self.canvas_manager.document
+        mark = document.journal.mark() if document.journal is not None else None
+        save = (document,mark,self.box_writer.write(document.box_path,document.boxes.file_representation),)
+        document.boxes.modified = False
+        self.pending_saves.append(save)
+        self.poll_saves()
+
+    def poll_saves(self):
+        ''' Finish the saves whose box file was written, checking back later while any is still being written. '''
+        for save in [save for save in self.pending_saves if save[2].done()]:
+            self.pending_saves.remove(save)
+            self.finish_save(*save)
+        if self.pending_saves: self.mainwindow.after(POLL_INTERVAL,self.poll_saves)
+
+    def finish_save(self, document: Document, mark: int|None, future: Future):
+        ''' Report a failed save, or record the new version of the box file and drop the saved edits from its journal. '''
+        if (error := future.exception()) is not None: 
+            document.boxes.modified = True
+            return display_save_error(document.box_path,error)
+        document.mtime = document.box_path.stat().st_mtime_ns
+        if document.journal is not None: document.journal.compact(since=mark)
+
+    @with_refresh
+    def validate_boxfile(self, event: tkinter.Event = None):
+        ''' Lint the loaded boxes against the image, highlight the problem boxes and report what was found. '''
+        issues = the.boxes.validate(image_sizes(self.canvas_manager.page_images.file.filename))
+        display_validation_report(issues)
 
     @with_refresh
     def activate_selection(self, event: tkinter.Event):
@@ -113,9 +297,10 @@ class GuiApp:
 
         Happens for single click.
         '''
-        clicked_point = [event.x,event.y]
+        clicked_point = canvas_point(event)
         clickable_objects = (DragBox,the.boxes)
         selected = any((obj.activate(clicked_point) for obj in clickable_objects))
+        if self.adjusting_dragbox: the.boxes.history.begin_group()
         if not selected: the.new_wordbox = NewWordBox(first_corner=clicked_point)
 
     @with_refresh
@@ -123,12 +308,17 @@ class GuiApp:
         ''' 
         Perform the drag and drop operation:
         
-         * If dragging a dragbox then correct the edge by adjusting its center position accordingly.
+         * If dragging a dragbox then correct the edge by adjusting its center position accordingly,
+           recording the move in the edit history (merged with the rest of the gesture).
          * If creating a new wordbox then continuously adjust its dimensions so it displays properly.
 
         '''
-        cursor_location = [event.x,event.y]
-        if self.adjusting_dragbox: the.active_dragbox.adjust(cursor_location)
+        cursor_location = canvas_point(event)
+        if self.adjusting_dragbox: 
+            row = the.active_wordbox.core.row
+            old_edges = the.boxes.history.edges(row)
+            the.active_dragbox.adjust(cursor_location)
+            the.boxes.history.record(EdgesDelta(row,old_edges,the.boxes.history.edges(row)))
         elif self.creating_wordbox: the.new_wordbox.adjust(cursor_location)
     
     @with_refresh
@@ -137,11 +327,12 @@ class GuiApp:
         Complete the current action: 
 
          * If drag and dropping a dragbox, then deactivate the dragbox so that subsequent motion does 
-           not affect the placement.
+           not affect the placement, and finish the undoable edit of the gesture.
          * If creating a new box, then finalize its creation and delete the NewWordBox item.
 
         Usually happens during mouse button release
         '''
+        if self.adjusting_dragbox: the.boxes.history.end_group()
         the.active_dragbox = None
         if self.creating_wordbox: the.new_wordbox.create()
 
@@ -150,14 +341,46 @@ class GuiApp:
         ''' 
         Delete the current active wordbox. Triggered by pressing delete. 
         '''
-        if the.active_wordbox: the.boxes.delete(the.active_wordbox)
+        if not the.active_wordbox: return
+        the.boxes.history.record(DeleteDelta(the.active_wordbox.core.row))
+        the.boxes.delete(the.active_wordbox)
+
+    @with_refresh
+    def undo(self, event: tkinter.Event = None):
+        ''' Undo the last edit of the wordboxes. Triggered by pressing Ctrl + Z. '''
+        if self.adjusting_dragbox or self.creating_wordbox: return
+        if the.boxes.history.undo(): the.active_wordbox = NoActiveWordBox()
+
+    @with_refresh
+    def redo(self, event: tkinter.Event = None):
+        ''' Redo the last edit of the wordboxes that was undone. Triggered by pressing Ctrl + Y. '''
+        if self.adjusting_dragbox or self.creating_wordbox: return
+        if the.boxes.history.redo(): the.active_wordbox = NoActiveWordBox()
 
     @with_refresh
     def edit_text(self,event: tkinter.Event):
         ''' 
         Edit text of the wordbox by launching a text editor dialogue. Usually during doubleclick.
         '''
-        if the.boxes.activate([event.x,event.y]): the.active_wordbox.launch_text_editor_dialog()
+        if the.boxes.activate(canvas_point(event)): the.active_wordbox.launch_text_editor_dialog()
+
+    def reocr_selection(self, event: tkinter.Event = None):
+        ''' 
+        Run tesseract in the background on just the selected wordbox, cropped from the image with some padding,
+        and offer the texts it recognizes in the text editor dialogue.
+        '''
+        if not (wordbox := the.active_wordbox): return
+        description = f'Re-OCR box: {wordbox.core.text}'
+        image = self.canvas_manager.crop_wordbox(wordbox)
+        self.job_manager.submit(tesseract_automation.reocr_job(image,description,on_done=partial(self.finish_reocr_job,wordbox)))
+
+    @with_refresh
+    def finish_reocr_job(self, wordbox: WordBox, job: Job):
+        ''' Let the user pick the new text of the wordbox among the candidates, if it still exists. '''
+        if job.state == FAILED: return display_job_error(job)
+        if job.state != DONE or the.boxes.by_row.get(wordbox.core.row) is not wordbox: return
+        if not job.result: return display_no_candidates_error()
+        wordbox.launch_text_editor_dialog(job.result)
 
     def copy_text(self, event: tkinter.Event = None):
         ''' Copy the text of the selected boxfile. '''
@@ -169,9 +392,47 @@ class GuiApp:
         '''
         Activate tooltip of wordbox under the mouse pointer.
         '''
-        wordbox = the.boxes.select([event.x,event.y]) 
+        wordbox = the.boxes.select(canvas_point(event))
         self.tooltip.display(wordbox)
 
+    @with_refresh
+    def scroll_view(self, event: tkinter.Event):
+        ''' 
+        Handle the mouse wheel: Zoom around the pointer while holding Control, scroll horizontally
+        while holding Shift and scroll vertically otherwise.
+        '''
+        direction = -1 if event.num == 4 or getattr(event,'delta',0) > 0 else 1
+        if event.state & CONTROL_MASK: self.canvas_manager.zoom(ZOOM_STEP**-direction,event.x,event.y)
+        elif event.state & SHIFT_MASK: self.canvas_manager.canvas.xview_scroll(direction,'units')
+        else: self.canvas_manager.canvas.yview_scroll(direction,'units')
+
+    def start_panning(self, event: tkinter.Event):
+        ''' Remember where the middle mouse button was pressed to pan the view from there. '''
+        self.canvas_manager.canvas.scan_mark(event.x,event.y)
+
+    @with_refresh
+    def pan(self, event: tkinter.Event):
+        ''' Pan the view following the mouse while the middle button is held. '''
+        self.canvas_manager.canvas.scan_dragto(event.x,event.y,gain=1)
+
+    @with_refresh
+    def zoom_in(self, event: tkinter.Event = None): self.canvas_manager.zoom(ZOOM_STEP)
+
+    @with_refresh
+    def zoom_out(self, event: tkinter.Event = None): self.canvas_manager.zoom(1/ZOOM_STEP)
+
+    @with_refresh
+    def reset_zoom(self, event: tkinter.Event = None): self.canvas_manager.reset_zoom()
+
+    def fit_window(self):
+        ''' Constrain the window width so both canvases fit the image exactly. '''
+        padx = self.canvas_manager.canvas.grid_info()['padx']
+        width = 2*(self.canvas_manager.fitted_size[0]+2*padx)
+        min_height = 100
+        max_height = self.mainwindow.winfo_screenheight()
+        self.mainwindow.minsize(width,min_height)
+        self.mainwindow.maxsize(width+2,max_height)
+
     @with_refresh
     def adjust_window(self,event: tkinter.Event): 
         ''' Adjust the window components to fit the window. '''
@@ -182,11 +443,16 @@ class GuiApp:
         self.about_dialogue.show()
 
     def exit(self, event: tkinter.Event = None):
-        ''' Close the program. '''
+        ''' Close the program once the pending saves are written. Unsaved edits are left in the journal of their box file. '''
+        self.box_writer.shutdown()
+        self.poll_saves()
+        if self.canvas_manager.document is not None: self.canvas_manager.document.close()
+        self.prefetcher.shutdown()
+        self.job_manager.shutdown()
         self.mainwindow.destroy()
         
             
 
 if __name__ == '__main__':
-    app = GuiApp()
+    with profiler.step('Initialize the GUI'): app = GuiApp()
     app.run()
\ No newline at end of file
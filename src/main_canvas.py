@@ -27,60 +27,47 @@ from __future__ import annotations
 
 import tkinter
 
-from typing import Any, Callable, TYPE_CHECKING
-from PIL import ImageTk,Image, ImageDraw,ImageOps
+from typing import Callable, Dict, List, Set, Tuple, TYPE_CHECKING
+from PIL import ImageTk,Image
 from functools import wraps
 from pathlib import Path
 
 from gui_builder import builder
 from global_scope import real_global_scope as the
-from parsing import parse
-from rendered_geometry import NewWordBox, RenderedBox, WordBoxes
+from parsing import BoxStore
+from documents import QUALITY_RESAMPLING, Document
+from base_geometry import ScreenTransform, edge_names
+from tile_pyramid import TILE_SIZE, TilePyramid
+from rendered_geometry import NewWordBox, RenderedBox, WordBox, WordBoxes
+from render_scheduler import MAIN_CANVAS, RenderScheduler
 
 __placeholder_image_path = Path(__file__).parents[1] / 'assets' / 'HyperKyube'
 PLACEHOLDER_IMAGE = str(__placeholder_image_path.with_suffix('.tiff'))
 PLACEHOLDER_BOXFILE = str(__placeholder_image_path.with_suffix('.box'))
 
-if TYPE_CHECKING: from main import GuiApp
-
-def convert_to_rgb(bw_img: Image.Image) -> Image.Image:
-    ''' Convert a black and white image into a color image. '''
-    color_image = Image.new('RGB',bw_img.size)
-    color_image.paste(bw_img)
-    return color_image
-
-def do_in_box_file_coordinates(method: Callable):
-    ''' 
-    Decorator: Flip the image upside down so it is in box file coordinates, 
-    perform the image operation, and flip it once more so it is in proper orientation. 
-    '''
-
-    @wraps(method)
-    def wrapper(self:Any,*args,**kwargs):
-        the.buffered_image = ImageOps.flip(the.buffered_image)
-        method(self,*args,**kwargs)
-        the.buffered_image = ImageOps.flip(the.buffered_image)
+FAST_RESAMPLING = Image.NEAREST
+QUALITY_UPGRADE_DELAY = 150 # Milliseconds without a new size before the high quality resample is made.
+REOCR_PADDING = 4 # Image pixels around a wordbox that are included when it's cropped for OCR.
+ZOOM_STEP = 1.25
+MIN_ZOOM = 1.0
+MAX_ZOOM = 32.0
 
-    return wrapper
+if TYPE_CHECKING: from main import GuiApp
 
+def canvas_point(event: tkinter.Event) -> List[int,int]:
+    ''' Return the point of the (potentially scrolled) canvas where the event happened. '''
+    return [int(event.widget.canvasx(event.x)),int(event.widget.canvasy(event.y))]
 
 def with_refresh(method: Callable):
     ''' 
-    Decorator: Refresh the gui by repainting the canvas and hiding tooltips 
-    after execution of the decorated method.
+    Decorator: Refresh the gui after execution of the decorated method by hiding tooltips and 
+    requesting the render scheduler to repaint the canvases and fit the window in the next frame.
     '''
     @wraps(method)
     def wrapper(self: GuiApp,*args,**kwargs):
         method(self,*args,**kwargs)
-        self.canvas_manager.display_image()
-        self.mirror_canvas.display_image()
-        padx = self.canvas_manager.canvas.grid_info()['padx']
-        width = 2*(the.buffered_image.width+2*padx)
-        min_height = 100
-        max_height = self.mainwindow.winfo_screenheight()
-        self.mainwindow.minsize(width,min_height)
-        self.mainwindow.maxsize(width+2,max_height)
         self.tooltip.hidetip()
+        self.render_scheduler.request()
 
     return wrapper
 
@@ -88,38 +75,202 @@ def with_refresh(method: Callable):
 class CanvasManager():
     ''' Class that manages displaying images on the main canvas. '''
 
-    def __init__(self):
+    def __init__(self, render_scheduler: RenderScheduler):
         self.canvas: tkinter.Canvas = builder.get_object('image_display')
-        self.load_original_image(PLACEHOLDER_IMAGE)
-        the.boxes = WordBoxes(parse(PLACEHOLDER_BOXFILE))
-        the.active_file_path = PLACEHOLDER_BOXFILE
-        self.display_image()
-
-    def load_original_image(self,img_path:str = None):
-        ''' Load the original image from a file.'''
-        self.original_image = convert_to_rgb(Image.open(img_path))
-
-    def scale_image(self,img: Image.Image):
-        ''' Return a copy of the image, scaled to the canvas size. '''
-        the.scale = max(self.canvas.winfo_reqheight(),self.canvas.winfo_height())/img.height
-        new_size = tuple((int(dimension*the.scale) for dimension in img.size))
-        the.buffered_image = img.resize(new_size)
-
-    def draw_rectangle(self, box: RenderedBox):
-        ''' Draw a rectangle on the image with the given dimensions and return the image. '''
-        rect = tuple(box.displacements)
-        ImageDraw.Draw(the.buffered_image).rectangle(xy=rect,outline=box.color)
-
-    @do_in_box_file_coordinates
-    def draw_rectangles(self):
-        ''' Draw all rectangles on the image from the boxes. '''
-        for box in the.boxes: self.draw_rectangle(box.rendered)
-        for dragbox in the.active_wordbox.dragboxes: self.draw_rectangle(dragbox)
-        if isinstance(the.new_wordbox,NewWordBox): self.draw_rectangle(the.new_wordbox)
+        self.render_scheduler = render_scheduler
+        self.pyramid: TilePyramid = None
+        self.tile_items: Dict[Tuple[int,int],Tuple[int,ImageTk.PhotoImage]] = {}
+        self._tiles_key: Tuple = None
+        self._resampling = QUALITY_RESAMPLING
+        self._pending_upgrade: str = None
+        self.box_items: Dict[WordBox,int] = {}
+        self.handle_items: List[int] = [self.canvas.create_rectangle(0,0,0,0,state=tkinter.HIDDEN) for _ in edge_names]
+        self.new_box_item: int = self.canvas.create_rectangle(0,0,0,0,state=tkinter.HIDDEN)
+        self._synced_key: Tuple = None
+        self._synced_viewport: Tuple[int,int,int,int] = None
+        self._listened_store: BoxStore = None
+        self._dirty_rows: Set[int] = set()
+        self._highlighted: WordBox = None
+        self.document: Document = None
+
+    @property
+    def page_images(self): return self.document.page_images
+
+    def show_document(self, document: Document):
+        ''' 
+        Make the (possibly prefetched) document the current one and show its first page, fitted in the canvas. 
+        Its wordboxes are created the first time it's shown and kept with it, so edits survive navigating away.
+        '''
+        self.document = document
+        if document.boxes is None: document.boxes = WordBoxes(document.store)
+        the.boxes = document.boxes
+        the.active_file_path = str(document.box_path)
+        the.zoom = 1.0
+        self.canvas.xview_moveto(0)
+        self.canvas.yview_moveto(0)
+        self.show_page(0)
+
+    def show_page(self, page: int):
+        ''' Load the original image and the wordboxes of the page and make it the current page. '''
+        self.document.boxes.load_pages(page)
+        self.pyramid = self.document.pyramid(page)
+        self.original_image = self.pyramid.image
+        the.page = page
+
+    @property
+    def fit_scale(self) -> float: 
+        ''' Return the scale at which the whole height of the image fits in the canvas. '''
+        return max(self.canvas.winfo_reqheight(),self.canvas.winfo_height())/self.original_image.height
+
+    @property
+    def viewport_size(self) -> Tuple[int,int]:
+        ''' Return the size of the canvas area in which documents are fitted. '''
+        return (self.canvas.winfo_width(),max(self.canvas.winfo_reqheight(),self.canvas.winfo_height()),)
+
+    @property
+    def fitted_size(self) -> Tuple[int,int]: 
+        ''' Return the size of the image when it is scaled to fit in the canvas. '''
+        return self.pyramid.scaled_size(self.fit_scale)
+
+    @property
+    def viewport(self) -> Tuple[int,int,int,int]:
+        ''' Return the (left, top, right, bottom) region of the scaled image that is visible on the canvas. '''
+        left, top = int(self.canvas.canvasx(0)), int(self.canvas.canvasy(0))
+        return (left,top,left + self.canvas.winfo_width(),top + self.canvas.winfo_height(),)
+
+    def scale_image(self):
+        ''' Set the scale from the canvas size and the zoom, and make the scroll region cover the scaled image. '''
+        the.scale = self.fit_scale*the.zoom
+        the.rendered_size = self.pyramid.scaled_size(the.scale)
+        self.canvas.configure(scrollregion=(0,0,*the.rendered_size))
+        the.viewport = self.viewport
+
+    def zoom(self, factor: float, x: int = None, y: int = None):
+        ''' Multiply the zoom by the factor, keeping the image point under the (x, y) canvas window position in place. '''
+        x = self.canvas.winfo_width()//2 if x is None else x
+        y = self.canvas.winfo_height()//2 if y is None else y
+        point, old_scale = (self.canvas.canvasx(x),self.canvas.canvasy(y),), the.scale
+        the.zoom = min(max(the.zoom*factor,MIN_ZOOM),MAX_ZOOM)
+        self.scale_image()
+        ratio = the.scale/old_scale
+        self.canvas.xview_moveto((point[0]*ratio - x)/the.rendered_size[0])
+        self.canvas.yview_moveto((point[1]*ratio - y)/the.rendered_size[1])
+        the.viewport = self.viewport
+
+    def reset_zoom(self):
+        ''' Fit the whole image in the canvas again. '''
+        the.zoom = 1.0
+        self.scale_image()
+        self.canvas.xview_moveto(0)
+        self.canvas.yview_moveto(0)
+        the.viewport = self.viewport
+
+    def schedule_quality_upgrade(self):
+        ''' 
+        Render tiles with the fast filter while the scale keeps changing, then upgrade them to high quality. 
+        A lone change of scale, like the window settling on its size after the first load, is rendered in high quality.
+        '''
+        self._resampling = FAST_RESAMPLING if self._pending_upgrade else QUALITY_RESAMPLING
+        if self._pending_upgrade: self.canvas.after_cancel(self._pending_upgrade)
+        self._pending_upgrade = self.canvas.after(QUALITY_UPGRADE_DELAY,self.upgrade_quality)
+
+    def upgrade_quality(self):
+        ''' Have the fast tiles, if any, replaced by high quality ones in the next frame. '''
+        self._pending_upgrade = None
+        if self._resampling == QUALITY_RESAMPLING: return
+        self._tiles_key = None
+        self.render_scheduler.request(MAIN_CANVAS)
+
+    def clear_tile_items(self):
+        ''' Delete all the tile items from the canvas. '''
+        for item,_ in self.tile_items.values(): self.canvas.delete(item)
+        self.tile_items.clear()
+
+    def sync_tile_items(self):
+        ''' 
+        Show the tiles covering the viewport and delete the ones that scrolled out of it. Only newly visible 
+        tiles are rendered (or taken from the pyramid's cache), and everything is redone when the scale changes.
+        A new page is rendered in high quality right away, so the tiles prefetched for it are reused.
+        '''
+        key = (self.pyramid,the.scale,)
+        if key != self._tiles_key:
+            self.clear_tile_items()
+            if self._tiles_key and self._tiles_key[0] is self.pyramid: self.schedule_quality_upgrade()
+            else: self._resampling = QUALITY_RESAMPLING
+            self._tiles_key = key
+        visible = set(self.pyramid.tiles_in(the.scale,the.viewport))
+        for cell in [cell for cell in self.tile_items if cell not in visible]: self.canvas.delete(self.tile_items.pop(cell)[0])
+        for column,row in visible.difference(self.tile_items):
+            photo = ImageTk.PhotoImage(self.pyramid.tile(the.scale,column,row,self._resampling))
+            item = self.canvas.create_image(column*TILE_SIZE,row*TILE_SIZE,anchor=tkinter.NW,image=photo)
+            self.canvas.tag_lower(item)
+            self.tile_items[(column,row,)] = (item,photo,)
+
+    def crop_wordbox(self, wordbox: WordBox, padding: int = REOCR_PADDING) -> Image.Image:
+        ''' Return the region of the original image inside the wordbox, padded on every side and clipped to the image. '''
+        left, bottom, right, top, _ = wordbox.core.store.coordinates[wordbox.core.row].tolist()
+        width, height = self.original_image.size
+        region = (max(left - padding,0),max(height - top - padding,0),min(right + padding,width),min(height - bottom + padding,height),)
+        return self.original_image.crop(region)
+
+    def place_rectangle(self, item: int, box: RenderedBox):
+        ''' Move and recolor an existing rectangle item to match a box that isn't a wordbox in the store. '''
+        left, top, right, bottom = box.displacements
+        height = the.rendered_size[1]
+        self.canvas.coords(item,left,height - top,right,height - bottom)
+        self.canvas.itemconfig(item,outline=box.color,state=tkinter.NORMAL)
+
+    def place_wordbox(self, wordbox: WordBox):
+        ''' Move and recolor the rectangle item of the wordbox, creating it if it doesn't exist yet. '''
+        rectangle = ScreenTransform.of(wordbox.core.store).screen[wordbox.core.row].tolist()
+        color = wordbox.rendered.color
+        if (item := self.box_items.get(wordbox)) is None:
+            self.box_items[wordbox] = self.canvas.create_rectangle(*rectangle,outline=color)
+        else:
+            self.canvas.coords(item,*rectangle)
+            self.canvas.itemconfig(item,outline=color)
+
+    def sync_wordbox_items(self):
+        ''' 
+        Bring the rectangle items of the wordboxes up to date. Only the wordboxes overlapping the viewport, found 
+        with the spatial index, have items. All of them are synced when the boxes, page, scale or image change,
+        otherwise only the items of the wordboxes that scrolled into view or were edited or (de)selected are touched.
+        '''
+        if self._listened_store is not the.boxes.store:
+            if self._listened_store is not None: self._listened_store.listeners.remove(self._dirty_rows.add)
+            the.boxes.store.listeners.append(self._dirty_rows.add)
+            self._listened_store = the.boxes.store
+        key = (the.boxes,the.page,the.scale,the.boxes.version,)
+        changed = []
+        if key != self._synced_key or the.viewport != self._synced_viewport:
+            visible = the.boxes.overlapping(the.viewport)
+            visible_set = set(visible)
+            for wordbox in [box for box in self.box_items if box not in visible_set]: 
+                self.canvas.delete(self.box_items.pop(wordbox))
+            changed = visible if key != self._synced_key else [box for box in visible if box not in self.box_items]
+            self._synced_key, self._synced_viewport = key, the.viewport
+        edited = {the.boxes.by_row.get(row) for row in self._dirty_rows} | {self._highlighted,the.active_wordbox or None}
+        changed += [wordbox for wordbox in edited if wordbox in self.box_items]
+        for wordbox in changed: self.place_wordbox(wordbox)
+        self._dirty_rows.clear()
+        self._highlighted = the.active_wordbox or None
+
+    def sync_transient_items(self):
+        ''' Bring the items of the dragboxes and of the wordbox being created up to date. '''
+        dragboxes = list(the.active_wordbox.dragboxes)
+        for index,item in enumerate(self.handle_items):
+            if index < len(dragboxes): self.place_rectangle(item,dragboxes[index])
+            else: self.canvas.itemconfig(item,state=tkinter.HIDDEN)
+        if isinstance(the.new_wordbox,NewWordBox): self.place_rectangle(self.new_box_item,the.new_wordbox)
+        else: self.canvas.itemconfig(self.new_box_item,state=tkinter.HIDDEN)
+        for item in [*self.handle_items,self.new_box_item]: self.canvas.tag_raise(item)
 
     def display_image(self):
-        ''' Display an Image object on the canvas.'''
-        self.scale_image(self.original_image)
-        self.draw_rectangles()
-        self.displayed_image = ImageTk.PhotoImage(the.buffered_image)
-        self.canvas.create_image(0,0,anchor=tkinter.NW,image=self.displayed_image)
+        ''' 
+        Display the visible part of the image and the boxes on the canvas. They are retained canvas items, 
+        so only the items affected by what changed since the last refresh are moved, recolored or rendered.
+        '''
+        self.scale_image()
+        self.sync_tile_items()
+        self.sync_wordbox_items()
+        self.sync_transient_items()
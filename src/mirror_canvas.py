@@ -24,61 +24,105 @@ by showing to-scale OCR text of all the wordboxes.
 
 from __future__ import annotations
 import tkinter
-from typing import Any, Callable
-from functools import wraps
-from PIL import Image, ImageOps, ImageTk
-from PIL.ImageDraw import  Draw
+from typing import Dict, List, Set, Tuple
+from PIL import Image, ImageTk
 
 from global_scope import real_global_scope as the
 from gui_builder import builder
-from rendered_geometry import WordBox, RenderedBox
+from base_geometry import ScreenTransform
+from parsing import BoxStore
+from rendered_geometry import WordBox
 
 
-def do_in_box_file_coordinates(method: Callable):
-    ''' 
-    Decorator: Flip the image upside down so it is in box file coordinates, 
-    perform the image operation, and flip it once more so it is in proper orientation. 
-    '''
-
-    @wraps(method)
-    def wrapper(self:Any,*args,**kwargs):
-        the.mirror_image = ImageOps.flip(the.mirror_image)
-        method(self,*args,**kwargs)
-        the.mirror_image = ImageOps.flip(the.mirror_image)
+class WordItems():
+    ''' The retained canvas items showing a single word on the mirror canvas. '''
+    __slots__ = ('image_item','rectangle_item','raster','photo')
 
-    return wrapper
+    def __init__(self, image_item: int, rectangle_item: int, raster: Image.Image, photo: ImageTk.PhotoImage):
+        self.image_item = image_item
+        self.rectangle_item = rectangle_item
+        self.raster = raster
+        self.photo = photo
 
 
 class MirrorCanvas():
-    ''' Object that mirrors the main canvas by displaying all the OCR'd text to scale. '''
+    ''' 
+    Object that mirrors the main canvas by displaying all the OCR'd text to scale. 
+
+    Every visible word is a retained image item along with a rectangle item, so a refresh only 
+    touches the words that were edited, (de)selected or that scrolled into or out of the viewport,
+    and the canvas takes care of repainting just the regions that changed.
+    '''
 
     def __init__(self): 
-        the.mirror_image = Image.new('RGB',the.buffered_image.size,'white')
         self.canvas: tkinter.Canvas = builder.get_object('mirror_canvas')
+        self.canvas.configure(background='white')
+        self.word_items: Dict[WordBox,WordItems] = {}
+        self._synced_key: Tuple = None
+        self._page_wordboxes: List[WordBox] = []
+        self._listened_store: BoxStore = None
+        self._dirty_rows: Set[int] = set()
+        self._highlighted: WordBox = None
 
-    def draw_rectangle(self, box: RenderedBox):
-        ''' Draw a rectangle on the image with the given dimensions and return the image. '''
-        rect = tuple(box.displacements)
-        Draw(the.mirror_image).rectangle(xy=rect,outline=box.color)
+    def place_word(self, wordbox: WordBox, rectangle: List[int]):
+        ''' Create or update the items of the word, only making a new image when its raster changed. '''
+        raster = wordbox.rendered.on_mirror_canvas
+        color = wordbox.rendered.color
+        if (items := self.word_items.get(wordbox)) is None:
+            photo = ImageTk.PhotoImage(raster)
+            image_item = self.canvas.create_image(*rectangle[:2],anchor=tkinter.NW,image=photo)
+            rectangle_item = self.canvas.create_rectangle(*rectangle,outline=color)
+            self.word_items[wordbox] = WordItems(image_item,rectangle_item,raster,photo)
+            return
+        if items.raster is not raster:
+            items.raster, items.photo = raster, ImageTk.PhotoImage(raster)
+            self.canvas.itemconfig(items.image_item,image=items.photo)
+        self.canvas.coords(items.image_item,*rectangle[:2])
+        self.canvas.coords(items.rectangle_item,*rectangle)
+        self.canvas.itemconfig(items.rectangle_item,outline=color)
 
-    def draw_word(self,box: WordBox):
-        ''' Draw a wordbox on the mirror image. '''
-        word = box.rendered.on_mirror_canvas
-        x = box.rendered.displacements.left
-        y = box.rendered.displacements.top - word.size[1]
-        the.mirror_image.paste(word,(x,y,),word)
-        self.draw_rectangle(box.rendered) 
+    def remove_word(self, wordbox: WordBox):
+        ''' Delete the items of the word from the canvas. '''
+        items = self.word_items.pop(wordbox)
+        self.canvas.delete(items.image_item,items.rectangle_item)
 
-    @do_in_box_file_coordinates
-    def draw_words(self):
-        ''' Draw all the words from the boxes. '''
-        for box in the.boxes: self.draw_word(box)
+    def visible_words(self) -> Dict[WordBox,List[int]]:
+        ''' Return the screen rectangles of the words on the current page that intersect the viewport. '''
+        if not self._page_wordboxes: return {}
+        rows = [wordbox.core.row for wordbox in self._page_wordboxes]
+        screen = ScreenTransform.of(the.boxes.store).screen[rows]
+        left, top, right, bottom = the.viewport
+        visible = (screen[:,0] <= right) & (screen[:,2] >= left) & (screen[:,1] <= bottom) & (screen[:,3] >= top)
+        return {self._page_wordboxes[index]: screen[index].tolist() for index in visible.nonzero()[0].tolist()}
 
+    def follow_viewport(self):
+        ''' Scroll the mirror canvas to the same region that is visible on the main canvas. '''
+        width, height = the.rendered_size
+        self.canvas.configure(scrollregion=(0,0,width,height))
+        self.canvas.xview_moveto(the.viewport[0]/width)
+        self.canvas.yview_moveto(the.viewport[1]/height)
 
     def display_image(self):
-        ''' Display the mirror image on the mirror canvas. '''
-        the.mirror_image = Image.new('RGB',the.buffered_image.size,'white')
-        self.draw_words()
-        self.displayed_image = ImageTk.PhotoImage(the.mirror_image)
-        self.canvas.create_image(0,0,anchor=tkinter.NW,image=self.displayed_image)
-        
\ No newline at end of file
+        ''' 
+        Bring the word items on the mirror canvas up to date. Every visible word is placed again when the 
+        boxes, page or scale change. Otherwise only the words that were edited, (de)selected or that just 
+        scrolled into view are placed, and those that scrolled out of view are deleted.
+        '''
+        self.follow_viewport()
+        if self._listened_store is not the.boxes.store:
+            if self._listened_store is not None: self._listened_store.listeners.remove(self._dirty_rows.add)
+            the.boxes.store.listeners.append(self._dirty_rows.add)
+            self._listened_store = the.boxes.store
+        key = (the.boxes,the.page,the.scale,the.boxes.version,)
+        if key != self._synced_key: self._page_wordboxes = list(the.boxes)
+        visible = self.visible_words()
+        for wordbox in [wordbox for wordbox in self.word_items if wordbox not in visible]: self.remove_word(wordbox)
+        if key != self._synced_key:
+            changed = visible.keys()
+            self._synced_key = key
+        else:
+            edited = {the.boxes.by_row.get(row) for row in self._dirty_rows} | {self._highlighted,the.active_wordbox or None}
+            changed = {wordbox for wordbox in visible if wordbox in edited or wordbox not in self.word_items}
+        for wordbox in changed: self.place_word(wordbox,visible[wordbox])
+        self._dirty_rows.clear()
+        self._highlighted = the.active_wordbox or None
@@ -0,0 +1,307 @@
+#
+#    HyperKyube: OCR Gui MultiTool.
+#
+#    Copyright 2022 Daniel Gesua
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#   
+
+'''
+Pluggable OCR backends, so the tesseract work of the GUI and the command line tools can be done by 
+whichever engine suits it best:
+
+- SubprocessBackend runs the tesseract executable, like pytesseract does. It's always available, and 
+  its runs can be cancelled by killing the subprocess, but every run pays for starting tesseract and 
+  loading the traineddata again.
+
+- TesserocrBackend calls the tesseract C API in-process through the optional tesserocr package, keeping 
+  a pool of initialized engines per language and engine mode. Small crops are recognized without any 
+  startup cost, which makes it the default when tesserocr is installed.
+
+- FakeBackend deterministically derives its output from the image contents without running tesseract,
+  so the pipeline can be exercised and benchmarked offline.
+
+The backend can be chosen with the HYPERKYUBE_OCR_BACKEND environment variable.
+'''
+
+from __future__ import annotations
+
+
+import os
+import csv
+import time
+import queue
+import shlex
+import hashlib
+import tempfile
+import threading
+import subprocess
+
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pytesseract import pytesseract
+from pytesseract.pytesseract import TesseractError, get_tesseract_version
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, NamedTuple, Tuple
+from PIL import Image
+
+from tesseract_jobs import JobCancelled
+
+try: import tesserocr
+except ImportError: tesserocr = None
+
+if TYPE_CHECKING: from tesseract_jobs import Job
+
+BACKEND_VARIABLE = 'HYPERKYUBE_OCR_BACKEND'
+TSV_HEADER = 'level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext\n'
+
+
+class Candidate(NamedTuple):
+    ''' A text recognized by tesseract, with its mean word confidence and the page segmentation mode used. '''
+    text: str
+    confidence: float
+    psm: int
+
+
+def tesseract_config(config_name: str, oem: int = None, psm: int = None) -> str:
+    ''' Return the command line config of a tesseract run with the given engine and page segmentation modes. '''
+    options = [f'--oem {oem}' if oem is not None else '',f'--psm {psm}' if psm is not None else '',config_name]
+    return ' '.join(option for option in options if option)
+
+
+def tesseract_command(img_path: str, output_basename: str, lang: str, config: str) -> List[str]:
+    ''' Return the command line of a tesseract run on the image. '''
+    return [pytesseract.tesseract_cmd,str(img_path),str(output_basename),'-l',lang,*shlex.split(config)]
+
+
+def run_command(command: List[str]):
+    ''' Run a tesseract command to completion, raising a TesseractError if it fails. '''
+    process = subprocess.run(command,stdin=subprocess.DEVNULL,stdout=subprocess.DEVNULL,stderr=subprocess.PIPE)
+    if process.returncode: raise TesseractError(process.returncode,process.stderr.decode('utf-8',errors='replace').strip())
+
+
+def mean_confidence(words: List[Tuple[str,float]], psm: int) -> Candidate|None:
+    ''' Return the recognized words joined into a text, with their mean confidence, ignoring empty words. '''
+    words = [(text.strip(),confidence) for text,confidence in words if text.strip() and confidence >= 0]
+    if not words: return None
+    return Candidate(' '.join(text for text,_ in words),sum(confidence for _,confidence in words)/len(words),psm)
+
+
+def read_tsv_words(tsv_path: Path) -> List[Tuple[str,float]]:
+    ''' Return the text and confidence of every word of a tesseract TSV output. '''
+    with open(tsv_path,newline='',encoding='utf-8') as tsv_file:
+        rows = csv.DictReader(tsv_file,delimiter='\t',quoting=csv.QUOTE_NONE)
+        return [(row['text'],float(row['conf'])) for row in rows if row['level'] == '5']
+
+
+def page_count(img_path: str) -> int:
+    ''' Return the number of pages of the image file. '''
+    with Image.open(img_path) as image: return getattr(image,'n_frames',1)
+
+
+class OcrBackend(ABC):
+    ''' 
+    Interface of the OCR backends. A job can be passed to the methods so that the backend can report 
+    progress and honour cancellation, which it must check at least before starting the work.
+    '''
+    name = 'abstract'
+
+    @abstractmethod
+    def version(self) -> str: 
+        ''' Return the version of the engine, which is part of the cache key of its outputs. '''
+
+    @abstractmethod
+    def make_lstmbox(self, img_path: str, lang: str, oem: int = None, psm: int = None, job: Job = None) -> bytes:
+        ''' Return the contents of the LSTM box file of every page of the image. '''
+
+    @abstractmethod
+    def make_tsv(self, img_path: str, lang: str, oem: int = None, psm: int = None, job: Job = None) -> bytes:
+        ''' Return the TSV output of every page of the image, with the position and confidence of every word. '''
+
+    @abstractmethod
+    def recognize(self, image: Image.Image, lang: str, psm: int, job: Job = None) -> Candidate|None:
+        ''' Return the text recognized in the image with the page segmentation mode, or None if there isn't any. '''
+
+    def warm(self, lang: str, oem: int = None):
+        ''' Get ready to serve requests in the language ahead of time. Only backends with something to prepare do anything. '''
+
+    @staticmethod
+    def check_cancelled(job: Job):
+        ''' Raise JobCancelled if the job has been cancelled. '''
+        if job is not None and job.cancel_requested: raise JobCancelled()
+
+
+class SubprocessBackend(OcrBackend):
+    ''' Backend that runs the tesseract executable for every request. '''
+    name = 'subprocess'
+
+    def version(self) -> str: return str(get_tesseract_version())
+
+    def run_to_file(self, img_path: str, lang: str, config: str, suffix: str, job: Job = None) -> bytes:
+        ''' Run tesseract on the image with the config and return the contents of the output file with the suffix. '''
+        run = job.run_process if job is not None else run_command
+        with tempfile.TemporaryDirectory(prefix='hyperkyube-') as directory:
+            output_basename = Path(directory) / 'output'
+            run(tesseract_command(img_path,output_basename,lang,config))
+            return output_basename.with_suffix(suffix).read_bytes()
+
+    def make_lstmbox(self, img_path: str, lang: str, oem: int = None, psm: int = None, job: Job = None) -> bytes:
+        return self.run_to_file(img_path,lang,tesseract_config('lstmbox',oem,psm),'.box',job)
+
+    def make_tsv(self, img_path: str, lang: str, oem: int = None, psm: int = None, job: Job = None) -> bytes:
+        return self.run_to_file(img_path,lang,tesseract_config('tsv',oem,psm),'.tsv',job)
+
+    def recognize(self, image: Image.Image, lang: str, psm: int, job: Job = None) -> Candidate|None:
+        run = job.run_process if job is not None else run_command
+        with tempfile.TemporaryDirectory(prefix='hyperkyube-') as directory:
+            img_path, output_basename = Path(directory) / 'crop.png', Path(directory) / 'output'
+            image.save(img_path)
+            run(tesseract_command(img_path,output_basename,lang,tesseract_config('tsv',psm=psm)))
+            return mean_confidence(read_tsv_words(output_basename.with_suffix('.tsv')),psm)
+
+
+class TesserocrBackend(OcrBackend):
+    ''' 
+    Backend that runs tesseract in-process through tesserocr. Initialized engines are kept in a pool per 
+    language and engine mode and reused, so the traineddata is only loaded when the pool grows. Requests 
+    only wait for an engine when more than pool_size of them run at once with the same language.
+    '''
+    name = 'tesserocr'
+
+    @contextmanager
+    def engine(self, lang: str, oem: int = None) -> Iterator[tesserocr.PyTessBaseAPI]:
+        ''' Borrow an initialized engine from the pool of the language and engine mode, creating it if needed. '''
+        with self._lock:
+            pool = self.pools.setdefault((lang,oem,),queue.LifoQueue())
+            create = pool.empty() and self.created.get((lang,oem,),0) < self.pool_size
+            if create: self.created[(lang,oem,)] = self.created.get((lang,oem,),0) + 1
+        if create:
+            options = {} if oem is None else {'oem': tesserocr.OEM(oem)}
+            api = tesserocr.PyTessBaseAPI(lang=lang,**options)
+        else: 
+            api = pool.get()
+        try: yield api
+        finally:
+            api.Clear()
+            pool.put(api)
+
+    def warm(self, lang: str, oem: int = None):
+        ''' Initialize an engine of the language ahead of time, so the first request doesn't wait for it. '''
+        with self.engine(lang,oem): pass
+
+    def version(self) -> str: return tesserocr.tesseract_version().split()[1]
+
+    def render_pages(self, img_path: str, lang: str, oem: int, psm: int, render: Callable, job: Job = None) -> List[str]:
+        ''' Recognize every page of the image and return what the render method of the engine returns for each. '''
+        pages = page_count(img_path)
+        output = []
+        with self.engine(lang,oem) as api, Image.open(img_path) as image:
+            # Always set, since engines borrowed from the pool keep the mode of the last request, like a Re-OCR's.
+            api.SetPageSegMode(tesserocr.PSM.AUTO if psm is None else tesserocr.PSM(psm))
+            for page in range(pages):
+                self.check_cancelled(job)
+                image.seek(page)
+                api.SetImage(image.convert('RGB'))
+                output.append(render(api,page))
+                if job is not None: job.progress = (page + 1)/pages
+        return output
+
+    def make_lstmbox(self, img_path: str, lang: str, oem: int = None, psm: int = None, job: Job = None) -> bytes:
+        render = lambda api,page: api.GetLSTMBoxText(page)
+        return ''.join(self.render_pages(img_path,lang,oem,psm,render,job)).encode('utf-8')
+
+    def make_tsv(self, img_path: str, lang: str, oem: int = None, psm: int = None, job: Job = None) -> bytes:
+        render = lambda api,page: api.GetTSVText(page)
+        return (TSV_HEADER + ''.join(self.render_pages(img_path,lang,oem,psm,render,job))).encode('utf-8')
+
+    def recognize(self, image: Image.Image, lang: str, psm: int, job: Job = None) -> Candidate|None:
+        self.check_cancelled(job)
+        with self.engine(lang) as api:
+            api.SetPageSegMode(tesserocr.PSM(psm))
+            api.SetImage(image)
+            return mean_confidence(api.MapWordConfidences(),psm)
+
+    def __init__(self, pool_size: int = 2) -> None:
+        if tesserocr is None: raise ImportError('The tesserocr backend requires the tesserocr package.')
+        self.pool_size = pool_size
+        self.pools: Dict[Tuple[str,int],queue.LifoQueue] = {}
+        self.created: Dict[Tuple[str,int],int] = {}
+        self._lock = threading.Lock()
+
+
+class FakeBackend(OcrBackend):
+    ''' 
+    Backend that never runs tesseract. Its output is derived from a hash of the image contents, so it's 
+    deterministic, and an optional delay per request simulates the time a real engine would take.
+    '''
+    name = 'fake'
+
+    def version(self) -> str: return '1.0'
+
+    def text_of(self, data: bytes) -> str: return f'fake{hashlib.blake2b(data,digest_size=3).hexdigest()}'
+
+    def make_lstmbox(self, img_path: str, lang: str, oem: int = None, psm: int = None, job: Job = None) -> bytes:
+        lines = []
+        with Image.open(img_path) as image:
+            for page in range(getattr(image,'n_frames',1)):
+                self.check_cancelled(job)
+                image.seek(page)
+                time.sleep(self.delay)
+                text, (width, height) = self.text_of(image.tobytes()), image.size
+                step = max(width//(len(text) + 1),1)
+                for index,character in enumerate(text):
+                    lines.append(f'{character} {index*step} 0 {(index + 1)*step} {height} {page}')
+                lines.append(f'\t {len(text)*step} 0 {(len(text) + 1)*step} {height} {page}')
+        return ''.join(f'{line}\n' for line in lines).encode('utf-8')
+
+    def make_tsv(self, img_path: str, lang: str, oem: int = None, psm: int = None, job: Job = None) -> bytes:
+        rows = [TSV_HEADER]
+        with Image.open(img_path) as image:
+            for page in range(getattr(image,'n_frames',1)):
+                self.check_cancelled(job)
+                image.seek(page)
+                time.sleep(self.delay)
+                digest, (width, height) = hashlib.blake2b(image.tobytes(),digest_size=32).digest(), image.size
+                line_height = max(height//len(digest),1)
+                for word,value in enumerate(digest):
+                    top = word*line_height
+                    rows.append(f'5\t{page + 1}\t1\t1\t{word + 1}\t1\t0\t{top}\t{width}\t{line_height}\t{value*100/255:.6f}\tfake{value:02x}\n')
+        return ''.join(rows).encode('utf-8')
+
+    def recognize(self, image: Image.Image, lang: str, psm: int, job: Job = None) -> Candidate|None:
+        self.check_cancelled(job)
+        time.sleep(self.delay)
+        return Candidate(self.text_of(image.tobytes() + bytes([psm])),float(90 - psm),psm)
+
+    def __init__(self, delay: float = 0.0) -> None: self.delay = delay
+
+
+BACKENDS: Dict[str,Callable[[],OcrBackend]] = {
+    SubprocessBackend.name: SubprocessBackend,
+    TesserocrBackend.name: TesserocrBackend,
+    FakeBackend.name: FakeBackend,
+}
+_backends: Dict[str,OcrBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name: str = None) -> OcrBackend:
+    ''' 
+    Return the shared instance of the named backend. By default it's the one named by the HYPERKYUBE_OCR_BACKEND 
+    environment variable, or the tesserocr backend if tesserocr is installed, or the subprocess backend otherwise.
+    '''
+    name = name or os.environ.get(BACKEND_VARIABLE) or (TesserocrBackend.name if tesserocr else SubprocessBackend.name)
+    if name not in BACKENDS: raise ValueError(f'Unknown OCR backend "{name}", expected one of: {", ".join(BACKENDS)}.')
+    with _backends_lock:
+        if name not in _backends: _backends[name] = BACKENDS[name]()
+        return _backends[name]
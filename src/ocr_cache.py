@@ -0,0 +1,187 @@
+#
+#    HyperKyube: OCR Gui MultiTool.
+#
+#    Copyright 2022 Daniel Gesua
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#   
+
+'''
+Module responsible for the on-disk, content-addressed cache of tesseract outputs, so running tesseract 
+again on an unchanged image only costs hashing it.
+
+Entries are keyed by the content hash of the image together with everything else that affects the output:
+the language, engine mode, page segmentation mode, config name and tesseract version. Every entry is a file
+named after the hash of its key, and its modification time is refreshed when it's read, so the least recently 
+used entries can be evicted once the cache grows beyond its size limit. The total size is counted once with a
+scan of the directory and then kept up to date as entries are written, so the directory is only walked again when 
+the limit is exceeded. The cache can be inspected or emptied from the command line:
+
+    python ocr_cache.py stats|clear
+'''
+
+from __future__ import annotations
+
+
+import os
+import sys
+import time
+import hashlib
+import argparse
+import threading
+
+from pathlib import Path
+from typing import List, NamedTuple, Tuple
+
+from box_cache import file_digest
+
+CACHE_DIR_VARIABLE = 'HYPERKYUBE_CACHE_DIR'
+DEFAULT_MAX_BYTES = 512*2**20
+ENTRY_SUFFIX = '.out'
+EVICTION_TARGET = 0.9 # Fraction of the size limit the cache is shrunk to, so eviction doesn't run on every write.
+
+
+def default_directory() -> Path:
+    ''' Return the cache directory, which can be overridden with the HYPERKYUBE_CACHE_DIR environment variable. '''
+    if (directory := os.environ.get(CACHE_DIR_VARIABLE)): return Path(directory)
+    cache_home = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(cache_home) / 'hyperkyube' / 'tesseract'
+
+
+class OcrKey(NamedTuple):
+    ''' Everything that determines the output of a tesseract run. '''
+    image_digest: str
+    lang: str
+    oem: int
+    psm: int
+    config: str
+    version: str
+
+    @classmethod
+    def of(cls: OcrKey, img_path: str, lang: str, oem: int, psm: int, config: str, version: str) -> OcrKey:
+        ''' Return the key of a tesseract run on the image as it currently is on disk. '''
+        return cls(file_digest(img_path).hex(),lang,oem,psm,config,version)
+
+    @property
+    def name(self) -> str: return hashlib.blake2b(repr(tuple(self)).encode('utf-8'),digest_size=20).hexdigest()
+
+
+class CacheStats(NamedTuple):
+    ''' A summary of the contents and usage of the cache. '''
+    entries: int
+    size: int
+    max_size: int
+    hits: int
+    misses: int
+
+
+class OcrCache():
+    ''' On-disk cache of tesseract outputs with size-based LRU eviction. '''
+
+    def path(self, key: OcrKey) -> Path: 
+        ''' Return the path of the entry of the key, spread over subdirectories named after its first characters. '''
+        name = key.name
+        return self.directory / name[:2] / f'{name}{ENTRY_SUFFIX}'
+
+    def get(self, key: OcrKey) -> bytes|None:
+        ''' Return the cached output of the run, marking it as recently used, or None if it isn't cached. '''
+        path = self.path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key: OcrKey, data: bytes):
+        ''' Store the output of the run atomically, then evict old entries if the cache grew too large. '''
+        path = self.path(key)
+        try:
+            path.parent.mkdir(parents=True,exist_ok=True)
+            temporary_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+            temporary_path.write_bytes(data)
+            try: replaced_size = path.stat().st_size
+            except OSError: replaced_size = 0
+            os.replace(temporary_path,path)
+        except OSError:
+            return
+        with self._lock:
+            if self.size is None: self.size = sum(stat.st_size for _,stat in self.entries())
+            else: self.size += len(data) - replaced_size
+            if self.size > self.max_size: self.evict()
+
+    def entries(self) -> List[Tuple[Path,os.stat_result]]: 
+        ''' Return the paths and stats of all the entries, least recently used first. '''
+        entries = []
+        for path in self.directory.glob(f'*/*{ENTRY_SUFFIX}'):
+            try: entries.append((path,path.stat(),))
+            except OSError: continue
+        return sorted(entries,key=lambda entry: entry[1].st_mtime_ns)
+
+    def evict(self):
+        ''' 
+        Delete the least recently used entries until the cache fits its size limit, with some room to spare, 
+        and recount its size from the scan. Nothing is deleted if the cache already fits.
+        '''
+        entries = self.entries()
+        size = sum(stat.st_size for _,stat in entries)
+        if size > self.max_size:
+            for path,stat in entries:
+                if size <= self.max_size*EVICTION_TARGET: break
+                path.unlink(missing_ok=True)
+                size -= stat.st_size
+        self.size = size
+
+    def clear(self):
+        ''' Delete all the entries. '''
+        for path,_ in self.entries(): path.unlink(missing_ok=True)
+        self.size = 0
+
+    def stats(self) -> CacheStats:
+        ''' Return the number and total size of the entries, and the hits and misses of this process. '''
+        entries = self.entries()
+        return CacheStats(len(entries),sum(stat.st_size for _,stat in entries),self.max_size,self.hits,self.misses)
+
+    def __init__(self, directory: Path = None, max_size: int = DEFAULT_MAX_BYTES) -> None:
+        self.directory = Path(directory) if directory else default_directory()
+        self.max_size = max_size
+        self.size: int|None = None # Total size of the entries, counted on the first write.
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+
+ocr_cache = OcrCache()
+
+
+def main(arguments: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Inspect or empty the cache of tesseract outputs.')
+    parser.add_argument('command',choices=['stats','clear'])
+    parser.add_argument('--dir',default=None,help=f'cache directory (default: {default_directory()})')
+    args = parser.parse_args(arguments)
+    cache = OcrCache(args.dir)
+    if args.command == 'clear': cache.clear()
+    entries, stats = cache.entries(), cache.stats()
+    print(f'Directory: {cache.directory}')
+    print(f'Entries:   {stats.entries}')
+    print(f'Size:      {stats.size/2**20:.1f} MiB of {stats.max_size/2**20:.0f} MiB')
+    if entries:
+        print(f'Oldest:    {time.ctime(entries[0][1].st_mtime)}')
+        print(f'Newest:    {time.ctime(entries[-1][1].st_mtime)}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
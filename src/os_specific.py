@@ -20,6 +20,7 @@
 This module contains code to make OS specific adjustments for compatabitity reasons
 '''
 
+from functools import cache
 from PIL import ImageFont
 import platform
 
@@ -29,8 +30,11 @@ elif 'linux' in platform.system().lower():
     font_name = 'Pillow/Tests/fonts/FreeMono.ttf'
 
 
-try:
-    FONT = ImageFont.truetype(font_name,100)
-except OSError:
-    FONT = ImageFont.load_default()
+@cache
+def font() -> ImageFont.FreeTypeFont:
+    ''' Return the font the OCR'd text is drawn with, loading it the first time it's needed. '''
+    try:
+        return ImageFont.truetype(font_name,100)
+    except OSError:
+        return ImageFont.load_default()
 
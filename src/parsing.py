@@ -25,37 +25,79 @@ from __future__ import annotations
 
 
 import re
-from types import SimpleNamespace
-from typing import List
-from pydantic.dataclasses import dataclass
-from dataclasses import astuple
+import mmap
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Tuple
+
+import numpy as np
+
+import box_cache
+
+if TYPE_CHECKING: from base_geometry import ScreenTransform
 
 
 SPLITTING_PATTERN = r'''(?P<text>.)\s # String containing the letter on that row
     (?P<left>\d+)\s      # Left edge displacement value
     (?P<bottom>\d+)\s    # Bottom edge displacement value
     (?P<right>\d+)\s     # Right edge displacement value
-    (?P<top>\d+)\s\d+\n  # Top edge displacement value'''
+    (?P<top>\d+)\s       # Top edge displacement value
+    (?P<page>\d+)\n      # Page number of the box'''
 
 letter_splitter = re.compile(SPLITTING_PATTERN,flags=re.VERBOSE)
 
+# Order of the coordinate columns in the box store. It matches the order of the values in a box file row.
+COLUMN_NAMES = ['left','bottom','right','top','page']
+COLUMN_INDEX = {name: index for index,name in enumerate(COLUMN_NAMES)}
+
 
-@dataclass
 class Displacements():
-    ''' Data class containing the displacement values from the origin for each edge in a box. '''
-    left: int
-    top: int
-    right: int
-    bottom: int
+    ''' Value object containing the displacement values from the origin for each edge in a box. '''
+    __slots__ = ('left','top','right','bottom')
+
+    def __init__(self, left: int, top: int, right: int, bottom: int) -> None:
+        self.left, self.top, self.right, self.bottom = int(left), int(top), int(right), int(bottom)
 
     @property
     def file_representation(self): return f'{self.left} {self.bottom} {self.right} {self.top} 0\n'
 
-    def __iter__(self): return iter(astuple(self)) 
+    def __iter__(self): return iter((self.left,self.top,self.right,self.bottom,))
+
+    def __repr__(self) -> str: return f'{type(self).__name__}({", ".join(map(str,self))})'
+
+
+class _Column():
+    ''' Descriptor exposing a single coordinate column of a box store row as an attribute. '''
+
+    def __set_name__(self, owner: type, name: str): self.index = COLUMN_INDEX[name]
+
+    def __get__(self, view: DisplacementsView, owner: type = None) -> int: 
+        return int(view.store.coordinates[view.row,self.index])
+
+    def __set__(self, view: DisplacementsView, value: int): 
+        view.store.coordinates[view.row,self.index] = int(value)
+        view.store.changed(view.row)
+
+
+class DisplacementsView(Displacements):
+    ''' Thin view over the displacements stored in a single row of a box store. '''
+    __slots__ = ('store','row')
+    left = _Column()
+    top = _Column()
+    right = _Column()
+    bottom = _Column()
+    page = _Column()
 
+    @property
+    def file_representation(self): return f'{self.left} {self.bottom} {self.right} {self.top} {self.page}\n'
+
+    def __init__(self, store: BoxStore, row: int) -> None:
+        self.store = store
+        self.row = row
 
-class WordBoxCore(SimpleNamespace):
-    ''' A simple namespace contianing the core attributes of a box bounding a word. '''
+
+class WordBoxCore():
+    ''' A thin view contianing the core attributes of a box bounding a word, stored in a row of a box store. '''
+    __slots__ = ('store','row','displacements')
 
     @classmethod
     def Empty(cls: WordBoxCore):
@@ -63,6 +105,12 @@ class WordBoxCore(SimpleNamespace):
         default_displacements = {key: 0 for key in 'left,top,right,bottom'.split(',')}
         return cls(text="",**default_displacements)
 
+    @property
+    def text(self) -> str: return self.store.text(self.row)
+
+    @text.setter
+    def text(self, value: str): self.store.set_text(self.row,value)
+
     @property
     def file_representation(self) -> str:
         ''' Return a string containing the file representation of this box as it appears in a box file.'''
@@ -71,12 +119,208 @@ class WordBoxCore(SimpleNamespace):
         rows = (f'{letter} {displacements}' for letter in letters)
         return ''.join(rows)
 
-    def __init__(self, row_match:re.Match = None,**kwargs) -> None:
-        ''' Create a core using either a regex match from file or explicitly passed parameters. '''
-        kwargs = kwargs if row_match is None else row_match.groupdict()
-        self.text: str = kwargs.pop('text') 
-        self.displacements = Displacements(**kwargs)
+    def __init__(self, store: BoxStore = None, row: int = 0, **kwargs) -> None:
+        ''' Create a view over a row of the store, or over a new single row store made from explicitly passed parameters. '''
+        if store is None: store,row = (new_store := BoxStore()),new_store.append(**kwargs).row
+        self.store = store
+        self.row = row
+        self.displacements = DisplacementsView(store,row)
+
+    def __repr__(self) -> str: return f'{type(self).__name__}({self.text!r}, {tuple(self.displacements)})'
+
+
+class BoxStore():
+    ''' 
+    Struct-of-arrays storage of all the word boxes in a box file. 
+
+    The coordinates are held in a single int32 array with one row per box and one column per value 
+    (in the order they appear in the file), while the texts are held in a single string buffer that
+    is sliced using an array of offsets. Edited texts are kept in a small overlay on top of the buffer.
+    '''
+
+    @classmethod
+    def from_text(cls: BoxStore, raw_data: str) -> BoxStore:
+        ''' Parse the raw data of a box file in bulk and return a store of its word boxes. '''
+        rows = letter_splitter.findall(raw_data)
+        if not rows: return cls()
+        letters, *columns = zip(*rows)
+        word_ends = np.flatnonzero(np.array(letters) == '\t')
+        coordinates = np.array(columns,dtype=np.int32).T[word_ends]
+        text_offsets = np.zeros(len(word_ends)+1,dtype=np.int64)
+        text_offsets[1:] = word_ends - np.arange(len(word_ends))
+        text_buffer = ''.join(letters).replace('\t','')[:text_offsets[-1]]
+        return cls(text_buffer,text_offsets,coordinates)
+
+    @property
+    def coordinates(self) -> np.ndarray: 
+        ''' Return the coordinate array of all boxes in the store. '''
+        return self._coordinates[:self.size]
+
+    def column(self, name: str) -> np.ndarray: 
+        ''' Return the coordinate column with the given name. '''
+        return self.coordinates[:,COLUMN_INDEX[name]]
+
+    def text(self, row: int) -> str:
+        ''' Return the text of the box in the given row. '''
+        if row in self._edited_texts: return self._edited_texts[row]
+        return self.text_buffer[self.text_offsets[row]:self.text_offsets[row+1]]
+
+    def set_text(self, row: int, value: str): 
+        self._edited_texts[row] = value
+        self.changed(row)
+
+    def set_coordinates(self, row: int, left: int, bottom: int, right: int, top: int):
+        ''' Move all the edges of the box in the given row at once, notifying the listeners a single time. '''
+        self._coordinates[row,:4] = [left,bottom,right,top]
+        self.changed(row)
+
+    def extend(self, other: BoxStore) -> range:
+        ''' Append all the boxes of the other store and return the range of their rows. '''
+        rows = range(self.size,self.size + len(other))
+        if rows.stop > len(self._coordinates):
+            grown = np.zeros((max(2*self.size,rows.stop),len(COLUMN_NAMES)),dtype=np.int32)
+            grown[:self.size] = self.coordinates
+            self._coordinates = grown
+        self._coordinates[rows.start:rows.stop] = other.coordinates
+        if len(self.text_offsets) - 1 == self.size:
+            self.text_offsets = np.concatenate((self.text_offsets,other.text_offsets[1:] + len(self.text_buffer)))
+            self.text_buffer += other.text_buffer
+        else:
+            for row in rows: self._edited_texts[row] = other.text(row - rows.start)
+        self.size = rows.stop
+        return rows
+
+    def load_pages(self, through: float = float('inf')) -> range:
+        ''' 
+        Parse the pages of a lazily opened box file that are still pending, in order, up to the requested page
+        (all of them by default), and return the range of the rows they were appended as.
+        '''
+        start = self.size
+        while self._pending_pages is not None and self.loaded_through < through:
+            page, store = next(self._pending_pages,(None,None))
+            if store is None: 
+                self.stop_loading()
+                break
+            self.extend(store)
+            self.loaded_through = page
+        return range(start,self.size)
+
+    def stop_loading(self):
+        ''' Forget the pages that are still pending, closing the box file they were being parsed from. '''
+        if self._pending_pages is not None: self._pending_pages.close()
+        self._pending_pages, self.loaded_through = None, float('inf')
+
+    def changed(self, row: int):
+        ''' Notify the listeners that the box in the given row was edited. '''
+        for listener in self.listeners: listener(row)
+
+    def text_lengths(self) -> np.ndarray:
+        ''' Return the length of the text of every box in the store. '''
+        lengths = np.zeros(self.size,dtype=np.int64)
+        buffered_rows = min(len(self.text_offsets) - 1,self.size)
+        lengths[:buffered_rows] = np.diff(self.text_offsets)[:buffered_rows]
+        for row,text in self._edited_texts.items(): lengths[row] = len(text)
+        return lengths
+
+    def append(self, text: str, left: int, top: int, right: int, bottom: int, page: int = 0) -> WordBoxCore:
+        ''' Append a new box to the store and return a core viewing it. '''
+        if self.size == len(self._coordinates):
+            grown = np.zeros((max(2*self.size,16),len(COLUMN_NAMES)),dtype=np.int32)
+            grown[:self.size] = self.coordinates
+            self._coordinates = grown
+        row = self.size
+        self._coordinates[row] = [left,bottom,right,top,page]
+        self._edited_texts[row] = text
+        self.size += 1
+        return WordBoxCore(self,row)
+
+    def __init__(self, text_buffer: str = '', text_offsets: np.ndarray = None, coordinates: np.ndarray = None):
+        empty_coordinates = np.zeros((0,len(COLUMN_NAMES)),dtype=np.int32)
+        self._coordinates: np.ndarray = empty_coordinates if coordinates is None else coordinates
+        self.size: int = len(self._coordinates)
+        self.text_buffer = text_buffer
+        self.text_offsets: np.ndarray = np.zeros(1,dtype=np.int64) if text_offsets is None else text_offsets
+        self._edited_texts: Dict[int,str] = {}
+        self.listeners: List[Callable[[int],None]] = []
+        self.transform: ScreenTransform = None
+        self._pending_pages: Iterator[Tuple[int,BoxStore]] = None
+        self.loaded_through: float = float('inf') # All the pages up to this one are parsed.
+
+    def __len__(self) -> int: return self.size
+
+    def __getitem__(self, row: int) -> WordBoxCore: return WordBoxCore(self,row)
+
+    def __iter__(self) -> Iterator[WordBoxCore]: return map(WordBoxCore,[self]*self.size,range(self.size))
+
+
+class PageIndex():
+    ''' 
+    Lightweight index of the byte offsets at which each page starts in a memory mapped box file.
+
+    Tesseract writes the rows in order of non-decreasing page number, so the start of any page can be 
+    found by bisecting the file, reading only a handful of rows. Offsets are memoized as they are found.
+    '''
+
+    def _line_start(self, offset: int) -> int: return self.data.rfind(b'\n',0,offset) + 1
+
+    def page_at(self, offset: int) -> int|float:
+        ''' 
+        Return the page number of the row containing the offset, or infinity past the last row of the file. 
+        Blank and malformed lines are skipped like parse skips them, so the next valid row is used instead.
+        '''
+        start = self._line_start(offset)
+        while start < len(self.data):
+            end = self.data.find(b'\n',start)
+            end = len(self.data) if end == -1 else end
+            row = letter_splitter.fullmatch(self.data[start:end + 1].decode('utf-8',errors='replace'))
+            if row: return int(row['page'])
+            start = end + 1
+        return float('inf')
+
+    def offset(self, page: int) -> int:
+        ''' Return the offset of the first row belonging to the page or any page after it. '''
+        if page not in self._offsets:
+            low, high = 0, len(self.data)
+            while low < high:
+                middle = (low + high)//2
+                if self.page_at(middle) < page: low = middle + 1
+                else: high = middle
+            self._offsets[page] = self._line_start(low)
+        return self._offsets[page]
+
+    def __init__(self, data: mmap.mmap) -> None:
+        self.data = data
+        self._offsets: Dict[int,int] = {}
+
+
+def iter_pages(file: str, first_page: int = 0) -> Iterator[Tuple[int,BoxStore]]:
+    ''' 
+    Lazily yield the page number and word boxes of each page in the box file, starting at the first page requested.
+    The file is memory mapped, so only the rows of the page being yielded are ever decoded and held in memory.
+    '''
+    if Path(file).stat().st_size == 0: return
+    with open(file,mode='rb') as f, mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) as data:
+        index = PageIndex(data)
+        start = index.offset(first_page)
+        while start < len(data):
+            page = index.page_at(start)
+            if page == float('inf'): return # Only blank or malformed lines are left.
+            end = index.offset(page + 1)
+            yield page, BoxStore.from_text(data[start:end].decode('utf-8'))
+            start = end
+
 
+def open_lazily(file: str) -> BoxStore:
+    ''' 
+    Return a store of the box file in which only the first page is parsed yet. The other pages are parsed when 
+    load_pages requests them, always in order, so every box gets the same row it would get from parse.
+    The whole file is loaded at once if the sidecar cache is valid for it, since that's just as fast.
+    '''
+    if (cached := box_cache.load(file)) is not None: return BoxStore(*cached)
+    store = BoxStore()
+    store._pending_pages, store.loaded_through = iter_pages(file), -1
+    store.load_pages(0)
+    return store
 
 
 def load_data(file: str) -> str:
@@ -85,29 +329,12 @@ def load_data(file: str) -> str:
     return raw_data
 
 
-def parse(file: str) -> List[WordBoxCore]:
-    ''' Parse the data from the box file into word box objects consisting of simple namespaces. '''
-
-    def _parse_character_boxes(raw_data: str) -> List[WordBoxCore]:
-        ''' Convert the raw data string into namespaces of all character boxes.'''
-        unparsed_rows = letter_splitter.finditer(raw_data)
-        character_boxes = list(map(WordBoxCore,unparsed_rows))
-        return character_boxes
-
-    def _extract_words(character_boxes: List[WordBoxCore]) -> List[str]:
-        ''' Extract a list of words out of the parsed character data. '''
-        characters = [symbol.text for symbol in character_boxes]
-        words = "".join(characters).split('\t')
-        return words
-
-    def _make_word_boxes(character_boxes: List[WordBoxCore], words: List[str]):
-        ''' Make word boxes out of the character boxes. '''
-        boxes = [box for box in character_boxes if box.text == '\t']
-        for box,word in zip(boxes,words): box.text = word
-        return boxes
-
-    raw_data = load_data(file)
-    character_boxes = _parse_character_boxes(raw_data)
-    words = _extract_words(character_boxes)
-    boxes = _make_word_boxes(character_boxes,words)
-    return boxes
\ No newline at end of file
+def parse(file: str) -> BoxStore:
+    ''' 
+    Parse the data from the box file into a columnar store of word boxes. 
+    Use the binary sidecar cache when it is valid for the file, and refresh it otherwise.
+    '''
+    if (cached := box_cache.load(file)) is not None: return BoxStore(*cached)
+    store = BoxStore.from_text(load_data(file))
+    box_cache.save(file,store.text_buffer,store.text_offsets,store.coordinates)
+    return store
@@ -0,0 +1,98 @@
+#
+#    HyperKyube: OCR Gui MultiTool.
+#
+#    Copyright 2022 Daniel Gesua
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#   
+
+'''
+Bounded LRU cache of the word rasters drawn on the mirror canvas.
+
+Rendering a word's text with a large TrueType font is the most expensive part of painting the 
+mirror canvas, yet the text and size of most words don't change between refreshes. Rasters are 
+cached by (text, font, target size), and the font-size render of each text is cached separately 
+so that it is shared by all the target sizes of that text. This way only the words that were 
+edited or resized get rasterized again.
+'''
+
+from __future__ import annotations
+
+
+from collections import OrderedDict
+from typing import Dict, Hashable, Tuple
+from PIL import Image, ImageFont
+from PIL.ImageDraw import ImageDraw
+
+_TRANSPARENT_COLOR = (255,255,255,0,)
+_BLACK_OPAQUE = (0,0,0,255,)
+
+
+class LRUCache(OrderedDict):
+    ''' Ordered dictionary that evicts its least recently used items beyond a maximum size and counts hits and misses. '''
+
+    def lookup(self, key: Hashable) -> Image.Image|None:
+        ''' Return the cached value of the key (marking it as recently used), or None. '''
+        if key not in self:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.move_to_end(key)
+        return self[key]
+
+    def store(self, key: Hashable, value: Image.Image) -> Image.Image:
+        ''' Cache the value, evicting the least recently used items if needed, and return it. '''
+        self[key] = value
+        while len(self) > self.max_size: self.popitem(last=False)
+        return value
+
+    def __init__(self, max_size: int) -> None:
+        super().__init__()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+
+class WordRasterCache():
+    ''' Cache of the rendered rasters of words, at font size and at the sizes they are displayed at. '''
+
+    def font_size_raster(self, text: str, font: ImageFont.FreeTypeFont) -> Image.Image:
+        ''' Return the raster of the text rendered at the font's own size. '''
+        if (raster := self.font_size_rasters.lookup((text,font,))) is not None: return raster
+        initial_size = tuple((max(dimension,1) for dimension in font.getsize(text)))
+        raster = Image.new('RGBA',initial_size,_TRANSPARENT_COLOR)
+        position = (initial_size[0]//2,initial_size[1]//2,)
+        ImageDraw(raster).text(position,text,fill=_BLACK_OPAQUE,font=font,anchor='mm')
+        return self.font_size_rasters.store((text,font,),raster)
+
+    def get(self, text: str, font: ImageFont.FreeTypeFont, size: Tuple[int,int]) -> Image.Image:
+        ''' Return the raster of the text resized to the size, rendering it only if it isn't cached. '''
+        if (raster := self.rasters.lookup((text,font,size,))) is not None: return raster
+        return self.rasters.store((text,font,size,),self.font_size_raster(text,font).resize(size))
+
+    @property
+    def stats(self) -> Dict[str,int]:
+        ''' Return the hit and miss counters of the cache. '''
+        return {
+            'hits': self.rasters.hits,
+            'misses': self.rasters.misses,
+            'font_size_hits': self.font_size_rasters.hits,
+            'font_size_misses': self.font_size_rasters.misses,
+        }
+
+    def __init__(self, max_rasters: int = 4096, max_font_size_rasters: int = 1024) -> None:
+        self.rasters = LRUCache(max_rasters)
+        self.font_size_rasters = LRUCache(max_font_size_rasters)
+
+
+word_rasters = WordRasterCache()
@@ -0,0 +1,82 @@
+#
+#    HyperKyube: OCR Gui MultiTool.
+#
+#    Copyright 2022 Daniel Gesua
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#   
+
+'''
+Frame scheduler that coalesces the refreshes requested by the GUI event handlers.
+
+Rather than repainting everything synchronously after every event, the handlers mark what needs 
+repainting as dirty and the scheduler flushes it at most once per frame from the Tk event loop.
+All events that arrive in between (like the motion events of a fast drag) are merged into that frame,
+and when painting a frame overruns the frame budget the following frames are dropped, so painting 
+can never fall behind the cursor.
+'''
+
+from __future__ import annotations
+
+
+from time import perf_counter
+from typing import TYPE_CHECKING, Set
+
+if TYPE_CHECKING: from main import GuiApp
+
+FRAME_BUDGET = 1/60 # Seconds per frame.
+
+MAIN_CANVAS = 'main_canvas'
+MIRROR_CANVAS = 'mirror_canvas'
+WINDOW = 'window'
+EVERYTHING = (MAIN_CANVAS,MIRROR_CANVAS,WINDOW,)
+
+
+class RenderScheduler():
+    ''' Collects dirty parts of the GUI and repaints them at most once per frame. '''
+
+    def request(self, *targets: str):
+        ''' Mark the targets (everything by default) as dirty and make sure a frame is scheduled to paint them. '''
+        self.dirty.update(targets or EVERYTHING)
+        if self._pending is not None: return
+        delay = max(0,int(1000*(self.next_frame_at - perf_counter())))
+        widget = self.app.mainwindow
+        self._pending = widget.after(delay,self.flush) if delay else widget.after_idle(self.flush)
+
+    def flush(self):
+        ''' 
+        Paint everything that is dirty, then work out when the next frame may start. 
+        Nothing is painted until the first document is shown, which requests a frame of its own.
+        '''
+        self._pending = None
+        if self.app.canvas_manager.document is None: return
+        dirty, self.dirty = self.dirty, set()
+        start = perf_counter()
+        if MAIN_CANVAS in dirty: self.app.canvas_manager.display_image()
+        if MIRROR_CANVAS in dirty: self.app.mirror_canvas.display_image()
+        if WINDOW in dirty: self.app.fit_window()
+        elapsed = perf_counter() - start
+        if elapsed <= self.frame_budget: 
+            self.next_frame_at = start + self.frame_budget
+        else:
+            # Drop the frames that were overrun, and leave a whole frame for the queued events to be merged.
+            self.dropped_frames += int(elapsed//self.frame_budget)
+            self.next_frame_at = start + elapsed + self.frame_budget
+
+    def __init__(self, app: GuiApp, frame_budget: float = FRAME_BUDGET) -> None:
+        self.app = app
+        self.frame_budget = frame_budget
+        self.dirty: Set[str] = set()
+        self.next_frame_at = 0.0
+        self.dropped_frames = 0
+        self._pending: str = None
@@ -22,20 +22,30 @@ This module contains all objects related to geometric entities rendered on the m
 
 
 from __future__ import annotations
-from PIL import Image,ImageFont
-from PIL.ImageDraw import ImageDraw
 
-from typing import List, Tuple
-from numpy import float64, dot
+import bisect
+import numpy as np
 
-from parsing import Displacements, WordBoxCore
+from PIL import Image
+
+from collections import defaultdict
+from functools import cached_property
+from typing import TYPE_CHECKING, DefaultDict, Dict, Iterator, List, Tuple
+
+from parsing import BoxStore, Displacements, WordBoxCore
+from validation import Issue, lint
+from spatial_index import GridIndex
 from global_scope import NoActiveWordBox, real_global_scope as the
 from dialogs import prompt_for_wordbox_text, display_invalid_value_error
-from base_geometry import Edges, Edge, RenderedBox
-from os_specific import FONT
+from base_geometry import Edges, Edge, RenderedBox, ScreenTransform
+from os_specific import font
+from raster_cache import word_rasters
+from confidence import confidence_color
+from edit_history import CreateDelta, EditHistory, TextDelta
 
-_TRANSPARENT_COLOR = (255,255,255,0,)
-_BLACK_OPAQUE = (0,0,0,255,)
+if TYPE_CHECKING: 
+    from ocr_backends import Candidate
+    from journal import EditJournal
 
 class DragBox(RenderedBox):
     ''' 
@@ -56,12 +66,8 @@ class DragBox(RenderedBox):
 
     @property
     def displacements(self) -> Displacements:
-        return Displacements(
-            left = dot(self.center.position,[1,0]) - self.size,
-            top = dot(self.center.position,[0,1]) + self.size,
-            right = dot(self.center.position,[1,0]) + self.size,
-            bottom = dot(self.center.position,[0,1]) - self.size
-        )
+        x, y = self.center.position
+        return Displacements(left=x - self.size, top=y + self.size, right=x + self.size, bottom=y - self.size)
 
     @property
     def color(self): return 'red'
@@ -79,36 +85,44 @@ class RenderedWordBox(RenderedBox):
     ''' The screen representation of a word box.'''
 
     @property
-    def color(self): return 'red' if self == the.active_wordbox.rendered else 'black'
+    def color(self): 
+        ''' 
+        Return red for the active wordbox, orange for wordboxes with validation issues, the color of 
+        the confidence of the wordbox when the confidence overlay is shown, and black otherwise. 
+        '''
+        if self == the.active_wordbox.rendered: return 'red'
+        if self.wordbox.core.row in the.boxes.issues: return 'orange'
+        if the.boxes.confidences is None: return 'black'
+        return confidence_color(the.boxes.confidence(self.wordbox.core.row))
+
+    @property
+    def scaled(self) -> Tuple[int,int,int,int]:
+        ''' Return the precomputed (left, top, right, bottom) rendered displacements of the wordbox. '''
+        core = self.wordbox.core
+        return tuple(ScreenTransform.of(core.store).scaled[core.row].tolist())
 
     @property
     def displacements(self):
         ''' Return the displacements of the edges in the rendered wordbox as a Displacements object. '''
-        return Displacements(**{edge.name:edge.displacement for edge in self.edges})
+        return Displacements(*self.scaled)
 
     @property
     def size(self) -> Tuple[int,int]:
         ''' Return the size of the box as a tuple. '''
-        width = self.displacements.right - self.displacements.left
-        height = self.displacements.top - self.displacements.bottom
-        return (width,height,)
+        left, top, right, bottom = self.scaled
+        return (right - left,top - bottom,)
 
     @property
-    def center(self) -> float64:
-        ''' Return the center of the box as a numpy array. '''
-        x = sum([edge.displacement for edge in self.edges.horizontal])/2
-        y = sum([edge.displacement for edge in self.edges.vertical])/2
-        return float64([x,y])
+    def center(self) -> Tuple[float,float]:
+        ''' Return the center of the box as a tuple. '''
+        left, top, right, bottom = self.scaled
+        return ((left + right)/2,(top + bottom)/2,)
 
     @property
     def on_mirror_canvas(self) -> Image.Image:
-        ''' Return an image of the wordbox containing the OCR'd text to scale. '''
-        text = self.wordbox.core.text
-        initial_size = FONT.getsize(text)
-        word_canvas = Image.new('RGBA',initial_size,_TRANSPARENT_COLOR)
-        position = (initial_size[0]//2,initial_size[1]//2,)
-        ImageDraw(word_canvas).text(position,text,fill=_BLACK_OPAQUE,font=FONT,anchor='mm')
-        return word_canvas.resize(self.size).transpose(Image.FLIP_TOP_BOTTOM)
+        ''' Return an image of the wordbox containing the OCR'd text to scale, from the word raster cache. '''
+        size = tuple((max(dimension,1) for dimension in self.size))
+        return word_rasters.get(self.wordbox.core.text,font(),size)
 
     def __init__(self,wordbox: WordBox):
         self.edges = Edges(wordbox)
@@ -121,28 +135,32 @@ class WordBox():
     @classmethod
     def Empty(cls: WordBox) -> WordBox: return cls(WordBoxCore.Empty())
 
+    @cached_property
+    def rendered(self) -> RenderedWordBox: 
+        ''' Return the screen representation of the wordbox, creating it on first use. '''
+        return RenderedWordBox(wordbox=self)
+
     @property
     def dragboxes(self): 
-        ''' Return the dragboxes '''
+        ''' Return the dragboxes, creating them on first use. '''
+        if self.rendered.edges.left.dragbox is None: self.create_dragboxes()
         return (edge.dragbox for edge in self.rendered.edges)
 
     def create_dragboxes(self):
         ''' Create the dragbox for each edge and register it. '''
         for edge in self.rendered.edges: edge.dragbox = DragBox(edge)
 
-    def launch_text_editor_dialog(self):
+    def launch_text_editor_dialog(self, candidates: List[Candidate] = ()):
         ''' 
-        Output a persistent dialogue to let user change the text of this wordbox. 
+        Output a persistent dialogue to let user change the text of this wordbox, optionally offering candidate texts. 
         Prevent user from canceling it or providing an empty string. 
         '''
-        while not (value := prompt_for_wordbox_text(self)): 
+        while not (value := prompt_for_wordbox_text(self,candidates)): 
             display_invalid_value_error()
+        if value != (old_value := self.core.text): the.boxes.history.record(TextDelta(self.core.row,old_value,value))
         self.core.text = value
 
-    def __init__(self, core: WordBoxCore):
-        self.core = core
-        self.rendered = RenderedWordBox(wordbox=self)
-        self.create_dragboxes()
+    def __init__(self, core: WordBoxCore): self.core = core
 
 class NewWordBox(RenderedWordBox):
     ''' Transient helper class for wordbox creation using rectangular drag selection. '''
@@ -167,10 +185,11 @@ class NewWordBox(RenderedWordBox):
         self._update_displacements()
 
     def _make_wordbox(self):
-        ''' Complete creation of the wordbox. '''
-        wordbox = WordBox(self.wordbox.core)
-        the.boxes.as_list.append(wordbox)
-        wordbox.launch_text_editor_dialog()
+        ''' Complete creation of the wordbox, which is undone along with its text as a single edit. '''
+        with the.boxes.history.grouped():
+            wordbox = the.boxes.add(self.wordbox.core)
+            the.boxes.history.record(CreateDelta(wordbox.core.row))
+            wordbox.launch_text_editor_dialog()
 
     def create(self):
         ''' If the box has two corners then finish creation. In the end self destruct. '''
@@ -184,17 +203,103 @@ class NewWordBox(RenderedWordBox):
         super().__init__(self.wordbox)
 
 class WordBoxes():
-    ''' Collection of all existing word boxes. '''
+    ''' 
+    Collection of all existing word boxes. 
+    Iterating over it yields only the boxes on the page that is currently displayed.
+    Its version is increased whenever boxes are added, deleted, (re)validated or their confidences change.
+    It's modified when edited since it was last saved. Its history holds the edits that can be undone. Once a journal is attached, every edit is logged to it.
+    '''
 
     @property
     def file_representation(self) -> str:
-        ''' Return the string containing the box file representation of the collection. '''
-        words = (box.core.file_representation for box in self)
+        ''' 
+        Return the string containing the box file representation of the collection, ordered by page.
+        Only the wordboxes edited since the last time are serialized again, the rest are taken from the cache.
+        '''
+        self.load_pages()
+        words = (self.serialized(box) for page in sorted(self.pages) for box in self.pages[page])
         return ''.join(words)
 
+    def serialized(self, wordbox: WordBox) -> str:
+        ''' Return the box file representation of the wordbox, from the cache unless it was edited. '''
+        if (text := self.serializations.get(row := wordbox.core.row)) is None: 
+            text = self.serializations[row] = wordbox.core.file_representation
+        return text
+
+    def load_pages(self, through: float = np.inf):
+        ''' Make the wordboxes of the pages of the store that are still pending, up to the page (all of them by default). '''
+        rows = self.store.load_pages(through)
+        pages = self.store.column('page')
+        for row in rows:
+            wordbox = WordBox(self.store[row])
+            self.as_list.append(wordbox)
+            self.pages[int(pages[row])].append(wordbox)
+            self.by_row[row] = wordbox
+        if rows: 
+            self.index.invalidate()
+            self.version += 1
+
+    def add(self, core: WordBoxCore, page: int = None) -> WordBox:
+        ''' 
+        Copy the core into the store as a new row on the page (the current one by default) and append a wordbox viewing it. 
+        All the pages are loaded first, so the rows of the boxes in the file never depend on the pages visited.
+        '''
+        self.load_pages()
+        page = the.page if page is None else page
+        new_core = self.store.append(core.text,*core.displacements,page=page)
+        wordbox = WordBox(new_core)
+        self.as_list.append(wordbox)
+        self.pages[page].append(wordbox)
+        self.by_row[new_core.row] = wordbox
+        if page == the.page: self.index.insert(wordbox)
+        self.version += 1
+        self.modified = True
+        if self.journal: self.journal.log_add(new_core.row)
+        return wordbox
+
+    def restore(self, row: int) -> WordBox:
+        ''' Bring back the deleted wordbox of the row, in its original place among the others. '''
+        wordbox = WordBox(WordBoxCore(self.store,row))
+        page = wordbox.core.displacements.page
+        by_row = lambda box: box.core.row
+        bisect.insort(self.as_list,wordbox,key=by_row)
+        bisect.insort(self.pages[page],wordbox,key=by_row)
+        self.by_row[row] = wordbox
+        # The index only holds the current page, and it's rebuilt when another page is shown.
+        if page == the.page: self.index.insert(wordbox)
+        self.version += 1
+        self.modified = True
+        if self.journal: self.journal.log_restore(row)
+        return wordbox
+
+    def validate(self, sizes: Dict[int,Tuple[int,int]] = None) -> List[Issue]:
+        ''' Lint all the wordboxes, remember the issues found for each one of them and return them. '''
+        self.load_pages()
+        issues = lint(self.store,[box.core.row for box in self.as_list],sizes)
+        self.issues = defaultdict(list)
+        for issue in issues: self.issues[issue.row].append(issue)
+        self.issues = dict(self.issues)
+        self.version += 1
+        return issues
+
+    def set_confidences(self, confidences: np.ndarray|None):
+        ''' Show the confidence of every row of the store in the color of its wordbox, or stop showing them if None. '''
+        self.confidences = confidences
+        self.version += 1
+
+    def confidence(self, row: int) -> float: 
+        ''' Return the confidence of the row, or NaN if it's unknown, like for wordboxes added since it was computed. '''
+        return float(self.confidences[row]) if row < len(self.confidences) else np.nan
+
     def delete(self,wordbox: WordBox): 
         ''' Remove the wordbox from the list and reset the active wordbox. '''
         self.as_list.remove(wordbox)
+        self.pages[wordbox.core.displacements.page].remove(wordbox)
+        self.by_row.pop(wordbox.core.row)
+        self.index.remove(wordbox)
+        self.version += 1
+        self.modified = True
+        if self.journal: self.journal.log_delete(wordbox.core.row)
         the.active_wordbox = NoActiveWordBox()
 
     def activate(self,point: List[int,int]) -> WordBox|NoActiveWordBox: 
@@ -206,11 +311,42 @@ class WordBoxes():
         ''' Return the first wordbox located at the selected point, or an empty wordbox if there isn't one. '''
         return next(self.containing(point),NoActiveWordBox())
 
-    def containing(self, point: List[int,int]): 
-        ''' Return a filter of all boxes located at the selected point. '''
-        return filter(lambda box: box.rendered.contains(point), self)
+    def containing(self, point: List[int,int]) -> Iterator[WordBox]: 
+        ''' Return an iterator over all boxes located at the selected point, looked up in the spatial index. '''
+        self.index.sync(self.pages[the.page])
+        return self.index.query(point)
+
+    def overlapping(self, region: Tuple[int,int,int,int]) -> List[WordBox]:
+        ''' Return the boxes of the current page overlapping the (left, top, right, bottom) screen region. '''
+        self.index.sync(self.pages[the.page])
+        return self.index.overlapping(region)
+
+    def close(self):
+        ''' Stop listening to the edits of the store, along with the journal, once the wordboxes are no longer used. '''
+        self.store.listeners.remove(self._box_changed)
+        if self.journal: self.store.listeners.remove(self.journal.log_set)
+
+    def _box_changed(self, row: int):
+        ''' Keep the spatial index and the serialization cache up to date when a box is edited. '''
+        self.serializations.pop(row,None)
+        self.modified = True
+        if (wordbox := self.by_row.get(row)): self.index.update(wordbox)
         
-    def __init__(self, cores: List[WordBoxCore]): self.as_list = [WordBox(core) for core in cores]
-
-    def __iter__(self): return iter(self.as_list)
+    def __init__(self, store: BoxStore): 
+        self.store = store
+        self.as_list = [WordBox(core) for core in store]
+        self.issues: Dict[int,List[Issue]] = {}
+        self.confidences: np.ndarray = None
+        self.pages: DefaultDict[int,List[WordBox]] = defaultdict(list)
+        for wordbox,page in zip(self.as_list,store.column('page').tolist()): self.pages[page].append(wordbox)
+        self.by_row: Dict[int,WordBox] = {box.core.row: box for box in self.as_list}
+        self.index = GridIndex()
+        self.version = 0
+        self.journal: EditJournal = None
+        self.history = EditHistory(self)
+        self.serializations: Dict[int,str] = {}
+        self.modified = False
+        store.listeners.append(self._box_changed)
+
+    def __iter__(self): return iter(self.pages[the.page])
 
@@ -0,0 +1,119 @@
+#
+#    HyperKyube: OCR Gui MultiTool.
+#
+#    Copyright 2022 Daniel Gesua
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#   
+
+'''
+Spatial index used to hit-test the wordboxes of the current page without scanning all of them.
+
+The wordboxes are bucketed into a uniform grid over their screen coordinates, so finding the boxes
+under a point only requires looking at the few boxes registered in that point's cell. The index is 
+kept up to date incrementally as boxes get edited, created or deleted, and it is rebuilt whenever the 
+scale, the image or the displayed page changes. Besides hit-testing, it finds the boxes in the visible
+region of the canvas, so only those need canvas items.
+'''
+
+from __future__ import annotations
+
+
+from collections import defaultdict
+from typing import TYPE_CHECKING, DefaultDict, Dict, Iterator, List, Set, Tuple
+
+from global_scope import real_global_scope as the
+from base_geometry import ScreenTransform
+
+if TYPE_CHECKING: from rendered_geometry import WordBox
+
+Rectangle = Tuple[int,int,int,int]
+
+
+class GridIndex():
+    ''' Uniform grid over the screen coordinates of the wordboxes on the current page. '''
+
+    @staticmethod
+    def current_key() -> Tuple[float,int,int]: 
+        ''' Return the values the screen coordinates of the boxes depend on. '''
+        return (the.scale,the.rendered_size[1],the.page)
+
+    def screen_rectangles(self, wordboxes: List[WordBox]) -> List[Rectangle]:
+        ''' Return the (left, top, right, bottom) screen coordinates of the wordboxes, computed all at once. '''
+        if not wordboxes: return []
+        screen = ScreenTransform.of(wordboxes[0].core.store).screen
+        return screen[[box.core.row for box in wordboxes]].tolist()
+
+    def _cells(self, rectangle: Rectangle) -> Iterator[Tuple[int,int]]:
+        ''' Return the keys of all cells touched by the rectangle. '''
+        left, top, right, bottom = (value//self.cell_size for value in rectangle)
+        return ((x,y,) for x in range(min(left,right),max(left,right)+1) for y in range(min(top,bottom),max(top,bottom)+1))
+
+    def insert(self, wordbox: WordBox, rectangle: Rectangle = None):
+        ''' Register the wordbox in all the cells its rectangle touches. '''
+        if rectangle is None: rectangle = self.screen_rectangles([wordbox])[0]
+        self.rectangles[wordbox] = rectangle
+        self.order.setdefault(wordbox,len(self.order))
+        for cell in self._cells(rectangle): self.cells[cell].add(wordbox)
+
+    def remove(self, wordbox: WordBox):
+        ''' Unregister the wordbox from all the cells it was in. '''
+        if (rectangle := self.rectangles.pop(wordbox,None)) is None: return
+        for cell in self._cells(rectangle): self.cells[cell].discard(wordbox)
+
+    def update(self, wordbox: WordBox):
+        ''' Re-register a wordbox whose geometry changed. Stale indexes are left to be rebuilt instead. '''
+        if wordbox not in self.rectangles or self.key != self.current_key(): return
+        self.remove(wordbox)
+        self.insert(wordbox)
+
+    def rebuild(self, wordboxes: List[WordBox]):
+        ''' Index the wordboxes from scratch using the current screen transformation. '''
+        self.cells.clear()
+        self.rectangles.clear()
+        self.order = {wordbox: order for order,wordbox in enumerate(wordboxes)}
+        for wordbox,rectangle in zip(wordboxes,self.screen_rectangles(wordboxes)): self.insert(wordbox,rectangle)
+        self.key = self.current_key()
+
+    def sync(self, wordboxes: List[WordBox]):
+        ''' Rebuild the index if the scale, image or page changed since it was built. '''
+        if self.key != self.current_key(): self.rebuild(wordboxes)
+
+    def query(self, point: List[int,int]) -> Iterator[WordBox]:
+        ''' Return the wordboxes containing the point, in the order they were indexed. '''
+        x, y = point
+        hits = []
+        for wordbox in self.cells.get((x//self.cell_size,y//self.cell_size,),()):
+            left, top, right, bottom = self.rectangles[wordbox]
+            if left <= x <= right and top <= y <= bottom: hits.append(wordbox)
+        return iter(sorted(hits,key=self.order.__getitem__))
+
+    def overlapping(self, region: Rectangle) -> List[WordBox]:
+        ''' Return the wordboxes whose rectangles overlap the (left, top, right, bottom) region, in the order they were indexed. '''
+        region_left, region_top, region_right, region_bottom = region
+        candidates = set()
+        for cell in self._cells(region): candidates.update(self.cells.get(cell,()))
+        hits = []
+        for wordbox in candidates:
+            left, top, right, bottom = self.rectangles[wordbox]
+            if left <= region_right and region_left <= right and top <= region_bottom and region_top <= bottom: hits.append(wordbox)
+        return sorted(hits,key=self.order.__getitem__)
+
+    def invalidate(self): self.key = None
+
+    def __init__(self, cell_size: int = 64) -> None:
+        self.cell_size = cell_size
+        self.cells: DefaultDict[Tuple[int,int],Set[WordBox]] = defaultdict(set)
+        self.rectangles: Dict[WordBox,Rectangle] = {}
+        self.order: Dict[WordBox,int] = {}
+        self.key: Tuple[float,int,int]|None = None
@@ -0,0 +1,143 @@
+#
+#    HyperKyube: OCR Gui MultiTool.
+#
+#    Copyright 2022 Daniel Gesua
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#   
+
+'''
+Module responsible for keeping the startup of the GUI fast, and for measuring it.
+
+Modules that are only needed once the user asks for something (like running tesseract) are imported 
+lazily with lazy_import: the module object is created right away, but its code only runs the first time 
+one of its attributes is used.
+
+Running main.py with --profile-startup reports how long importing every module took (both on its own 
+and including the modules it imported in turn) and how long each step of initializing the GUI took, 
+down to the first frame being displayed.
+'''
+
+from __future__ import annotations
+
+
+import sys
+import time
+import importlib.util
+
+from contextlib import contextmanager
+from types import ModuleType
+from typing import Iterator, List, NamedTuple
+
+PROFILE_FLAG = '--profile-startup'
+REPORT_LENGTH = 25
+
+
+def lazy_import(name: str) -> ModuleType:
+    ''' Return the module, deferring running its code until one of its attributes is first used. '''
+    if name in sys.modules: return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class Timing(NamedTuple):
+    ''' How long a module took to import or a step took to run, in seconds, on its own and in total. '''
+    name: str
+    own: float
+    total: float
+
+
+class _TimedLoader():
+    ''' Loader wrapper that times running the code of a module. '''
+
+    def create_module(self, spec): return self.loader.create_module(spec)
+
+    def __getattr__(self, name: str): return getattr(self.loader,name)
+
+    def exec_module(self, module: ModuleType):
+        with self.profiler.timed(module.__name__,self.profiler.imports): self.loader.exec_module(module)
+
+    def __init__(self, loader, profiler: StartupProfiler) -> None:
+        self.loader = loader
+        self.profiler = profiler
+
+
+class StartupProfiler():
+    ''' Records the import time of every module imported after it's started, and the time of the steps it's told about. '''
+
+    def find_spec(self, name: str, path=None, target=None):
+        ''' Find the module with the rest of the finders, and wrap its loader to time it. '''
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder,'find_spec'): continue
+            if (spec := finder.find_spec(name,path,target)) is None: continue
+            if spec.loader is not None and hasattr(spec.loader,'exec_module'): 
+                spec.loader = _TimedLoader(spec.loader,self)
+            return spec
+        return None
+
+    @contextmanager
+    def timed(self, name: str, timings: List[Timing]) -> Iterator[None]:
+        ''' Time the block, not counting the time of the blocks timed inside it towards its own time. '''
+        self._nested.append(0.0)
+        start = time.perf_counter()
+        try: yield
+        finally:
+            total = time.perf_counter() - start
+            own = total - self._nested.pop()
+            if self._nested: self._nested[-1] += total
+            timings.append(Timing(name,own,total))
+
+    def step(self, name: str):
+        ''' Time a step of the initialization of the GUI, if the profiler is running. '''
+        return self.timed(name,self.steps) if self.running else _untimed()
+
+    def start(self):
+        ''' Start timing the imports. '''
+        self.started = time.perf_counter()
+        self.running = True
+        sys.meta_path.insert(0,self)
+
+    def stop(self): 
+        ''' Stop timing the imports, and report the time it all took so far if the profiler was running. '''
+        if not self.running: return
+        elapsed = time.perf_counter() - self.started
+        sys.meta_path.remove(self)
+        self.running = False
+        print(self.report(elapsed),file=sys.stderr)
+
+    def report(self, elapsed: float) -> str:
+        ''' Return a table of the slowest imports and of all the steps, along with the total time to the first frame. '''
+        slowest = sorted(self.imports,key=lambda timing: -timing.own)[:REPORT_LENGTH]
+        lines = [f'Startup took {1000*elapsed:.1f} ms to the first frame.','',f'{"Import":<40}{"Own ms":>10}{"Total ms":>10}']
+        lines += [f'{timing.name:<40}{1000*timing.own:>10.1f}{1000*timing.total:>10.1f}' for timing in slowest]
+        lines += ['',f'{"Initialization step":<40}{"Own ms":>10}{"Total ms":>10}']
+        lines += [f'{timing.name:<40}{1000*timing.own:>10.1f}{1000*timing.total:>10.1f}' for timing in self.steps]
+        return '\n'.join(lines)
+
+    def __init__(self) -> None:
+        self.imports: List[Timing] = []
+        self.steps: List[Timing] = []
+        self.running = False
+        self.started = 0.0
+        self._nested: List[float] = []
+
+
+@contextmanager
+def _untimed() -> Iterator[None]: yield
+
+
+profiler = StartupProfiler()
@@ -20,11 +20,91 @@
 Responsible for automating the various functions of tesseract-ocr from within the GUI.
 '''
 
-from pytesseract.pytesseract import run_tesseract
+from __future__ import annotations
+
+
+import os
+
 from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+from PIL import Image
+
+from ocr_backends import Candidate, OcrBackend, get_backend, page_count
+from ocr_cache import OcrCache, OcrKey, ocr_cache
+from tesseract_jobs import Job
+
+SINGLE_WORD_PSM, SINGLE_LINE_PSM, RAW_LINE_PSM = 8, 7, 13
+REOCR_PSMS = (SINGLE_WORD_PSM,SINGLE_LINE_PSM,RAW_LINE_PSM,)
 
-def make_lstmbox_file(file_path: str):
-    ''' Run tesseract's LSTM box routine on the desired tiff image. '''
+
+def cached_output(file_path: str, lang: str, oem: int, psm: int, config: str, produce: Callable[[OcrBackend],bytes], 
+    cache: OcrCache|None = ocr_cache, backend: OcrBackend = None) -> Tuple[OcrKey,bytes]:
+    ''' 
+    Return the cache key and output of a tesseract run on the image, producing it with the backend and caching it
+    unless the output for the same image contents and settings is already cached.
+    '''
+    backend = backend or get_backend()
+    key = OcrKey.of(file_path,lang,oem,psm,config,f'{backend.name} {backend.version()}')
+    if cache is None or (output := cache.get(key)) is None:
+        output = produce(backend)
+        if cache is not None: cache.put(key,output)
+    return key, output
+
+
+def make_lstmbox_file(file_path: str, lang: str = 'eng', oem: int = None, psm: int = None, 
+    cache: OcrCache|None = ocr_cache, backend: OcrBackend = None, job: Job = None) -> OcrKey:
+    ''' 
+    Run tesseract's LSTM box routine on the desired tiff image, unless its output for the same image contents
+    and settings is already cached. The box file is written under a temporary name and then moved in place, 
+    so an interrupted run never leaves a truncated box file behind. Return the cache key of the run.
+    '''
     path = Path(file_path)
-    output_basename = path.with_suffix('')
-    run_tesseract(str(path),str(output_basename),'box','eng','lstmbox')
+    produce = lambda backend: backend.make_lstmbox(str(path),lang,oem,psm,job)
+    key, output = cached_output(path,lang,oem,psm,'lstmbox',produce,cache,backend)
+    partial_path = path.with_name(f'.{path.stem}.partial.box')
+    try:
+        partial_path.write_bytes(output)
+        os.replace(partial_path,path.with_suffix('.box'))
+    finally:
+        partial_path.unlink(missing_ok=True)
+    return key
+
+
+def make_tsv(file_path: str, lang: str = 'eng', oem: int = None, psm: int = None, 
+    cache: OcrCache|None = ocr_cache, backend: OcrBackend = None, job: Job = None) -> bytes:
+    ''' Return tesseract's TSV output for the image, with the position and confidence of every word, from the cache if possible. '''
+    produce = lambda backend: backend.make_tsv(str(file_path),lang,oem,psm,job)
+    return cached_output(file_path,lang,oem,psm,'tsv',produce,cache,backend)[1]
+
+
+def lstmbox_job(file_path: str, lang: str = 'eng', on_done: Callable[[Job],None] = None) -> Job:
+    ''' Return a job that makes the LSTM box file of the image in the background, and can be cancelled. '''
+    task = lambda job: make_lstmbox_file(file_path,lang,job=job)
+    return Job(f'Make box file: {Path(file_path).name}',task,on_done,page_count(file_path))
+
+
+def tsv_job(file_path: str, lang: str = 'eng', on_done: Callable[[Job],None] = None) -> Job:
+    ''' Return a job that gets the TSV output of the image in the background, and can be cancelled. '''
+    task = lambda job: make_tsv(file_path,lang,job=job)
+    return Job(f'Confidences: {Path(file_path).name}',task,on_done,page_count(file_path))
+
+
+def recognize_crop(image: Image.Image, lang: str = 'eng', psms: tuple = REOCR_PSMS, 
+    backend: OcrBackend = None, job: Job = None) -> List[Candidate]:
+    ''' 
+    Recognize the text of a small image, like the crop of a single wordbox, once per page segmentation mode.
+    Return the distinct texts recognized, most confident first.
+    '''
+    backend = backend or get_backend()
+    candidates: Dict[str,Candidate] = {}
+    for psm in psms:
+        if (candidate := backend.recognize(image,lang,psm,job)) is None: continue
+        if candidate.text not in candidates or candidates[candidate.text].confidence < candidate.confidence:
+            candidates[candidate.text] = candidate
+    return sorted(candidates.values(),key=lambda candidate: -candidate.confidence)
+
+
+def reocr_job(image: Image.Image, description: str, lang: str = 'eng', on_done: Callable[[Job],None] = None) -> Job:
+    ''' Return a job that recognizes the candidate texts of the image in the background, and can be cancelled. '''
+    task = lambda job: recognize_crop(image,lang,job=job)
+    return Job(description,task,on_done)
@@ -0,0 +1,193 @@
+#
+#    HyperKyube: OCR Gui MultiTool.
+#
+#    Copyright 2022 Daniel Gesua
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#   
+
+'''
+Background job manager for tesseract work, so OCR runs never block the Tk event loop.
+
+Jobs are run by a small pool of worker threads. Each job's tesseract subprocess is tracked so it can be 
+killed to cancel the job, and its progress is read from the pages tesseract reports on stderr. Finished 
+jobs are handed back to the Tk thread by polling a queue with after(), where their callbacks are run.
+'''
+
+from __future__ import annotations
+
+
+import re
+import time
+import queue
+import itertools
+import threading
+import subprocess
+import tkinter
+
+from collections import deque
+from typing import Any, Callable, Deque, List
+
+from startup import lazy_import
+
+pytesseract = lazy_import('pytesseract')
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'Queued', 'Running', 'Done', 'Failed', 'Cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED,)
+POLL_INTERVAL = 100 # Milliseconds between checks for finished jobs.
+HISTORY_LENGTH = 50 # Finished jobs kept for display.
+PAGE_PATTERN = re.compile(r'^Page (\d+)')
+
+_job_ids = itertools.count(1)
+
+
+class JobCancelled(Exception):
+    ''' Raised inside a job's task when the job was cancelled. '''
+
+
+class Job():
+    ''' 
+    A unit of tesseract work along with its state, progress and timing. The task is called with the job
+    in a worker thread, and must run its subprocesses through run_process so they can be cancelled.
+    '''
+
+    @property
+    def is_finished(self) -> bool: return self.state in FINISHED_STATES
+
+    @property
+    def elapsed(self) -> float:
+        ''' Return how many seconds the job has been running for, or ran for if it has finished. '''
+        if self.started is None: return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    def run_process(self, command: List[str]):
+        ''' 
+        Run the command to completion, updating the progress from the pages tesseract reports on stderr.
+        Raise JobCancelled if the job is cancelled meanwhile, or a TesseractError if the command fails.
+        '''
+        with self._lock:
+            if self.cancel_requested: raise JobCancelled()
+            self.process = subprocess.Popen(command,stdin=subprocess.DEVNULL,stdout=subprocess.DEVNULL,stderr=subprocess.PIPE)
+        errors = []
+        for line in self.process.stderr:
+            line = line.decode('utf-8',errors='replace')
+            if (match := PAGE_PATTERN.match(line)): self.progress = min(int(match.group(1))/self.page_count,1.0)
+            else: errors.append(line)
+        returncode = self.process.wait()
+        if self.cancel_requested: raise JobCancelled()
+        if returncode: raise pytesseract.TesseractError(returncode,''.join(errors).strip())
+
+    def cancel(self):
+        ''' Request the job to stop, killing its running subprocess if it has one. '''
+        with self._lock:
+            self.cancel_requested = True
+            process = self.process
+        if process is not None and process.poll() is None: process.kill()
+
+    def run(self):
+        ''' Run the task in the current (worker) thread, recording its outcome. '''
+        if not self.cancel_requested:
+            self.state, self.started = RUNNING, time.monotonic()
+            try:
+                self.result = self.task(self)
+                self.progress, self.state = 1.0, DONE
+            except JobCancelled:
+                self.state = CANCELLED
+            except Exception as error:
+                self.state, self.error = FAILED, error
+        if self.cancel_requested and self.state != DONE: self.state = CANCELLED
+        self.finished = time.monotonic()
+
+    def __init__(self, description: str, task: Callable[[Job],Any], on_done: Callable[[Job],None] = None, page_count: int = 1) -> None:
+        self.id = next(_job_ids)
+        self.description = description
+        self.task = task
+        self.on_done = on_done
+        self.page_count = max(page_count,1)
+        self.state = QUEUED
+        self.progress = 0.0
+        self.result: Any = None
+        self.error: Exception = None
+        self.started: float = None
+        self.finished: float = None
+        self.process: subprocess.Popen = None
+        self.cancel_requested = False
+        self._lock = threading.Lock()
+
+
+class JobManager():
+    ''' 
+    Runs jobs on a pool of worker threads and delivers the finished ones back to the Tk thread, 
+    by polling with after() for as long as there are jobs that haven't been delivered yet.
+    '''
+
+    @property
+    def active_jobs(self) -> List[Job]: return [job for job in self.jobs if not job.is_finished]
+
+    def submit(self, job: Job) -> Job:
+        ''' Queue the job, starting another worker thread if all the others are busy. '''
+        self.jobs.append(job)
+        self._undelivered += 1
+        if len(self.workers) < self.max_workers and len(self.active_jobs) > len(self.workers):
+            worker = threading.Thread(target=self.work,name=f'tesseract-job-{len(self.workers)}',daemon=True)
+            self.workers.append(worker)
+            worker.start()
+        self.queued.put(job)
+        self.schedule_poll()
+        return job
+
+    def cancel(self, job: Job):
+        ''' Cancel the job. Queued jobs are skipped, and running ones have their subprocess killed. '''
+        job.cancel()
+        self.schedule_poll()
+
+    def work(self):
+        ''' Worker thread loop: run queued jobs until the manager shuts down. '''
+        while (job := self.queued.get()) is not None:
+            job.run()
+            self.finished.put(job)
+
+    def schedule_poll(self):
+        ''' Poll for finished jobs after the poll interval, unless a poll is already scheduled. '''
+        if self._pending_poll is None: self._pending_poll = self.widget.after(POLL_INTERVAL,self.poll)
+
+    def poll(self):
+        ''' 
+        Run the callbacks of the jobs that finished since the last poll, then let the listeners display the
+        state of all the jobs. Keep polling while there are jobs left to deliver.
+        '''
+        self._pending_poll = None
+        while True:
+            try: job = self.finished.get_nowait()
+            except queue.Empty: break
+            self._undelivered -= 1
+            if job.on_done: job.on_done(job)
+        while len(self.jobs) > HISTORY_LENGTH and self.jobs[0].is_finished: self.jobs.popleft()
+        for listener in self.listeners: listener()
+        if self._undelivered: self.schedule_poll()
+
+    def shutdown(self):
+        ''' Cancel all the jobs and stop the worker threads. '''
+        for job in self.active_jobs: job.cancel()
+        for _ in self.workers: self.queued.put(None)
+
+    def __init__(self, widget: tkinter.Misc, max_workers: int = 2) -> None:
+        self.widget = widget
+        self.max_workers = max_workers
+        self.jobs: Deque[Job] = deque()
+        self.workers: List[threading.Thread] = []
+        self.queued: queue.Queue[Job|None] = queue.Queue()
+        self.finished: queue.Queue[Job] = queue.Queue()
+        self.listeners: List[Callable[[],None]] = []
+        self._undelivered = 0
+        self._pending_poll: str = None
@@ -0,0 +1,83 @@
+#
+#    HyperKyube: OCR Gui MultiTool.
+#
+#    Copyright 2022 Daniel Gesua
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#   
+
+'''
+Multi-resolution tile pyramid used to display scans of any size on the zoomable main canvas.
+
+Rather than resizing the whole scan whenever the scale changes, the image is split into fixed-size
+tiles that are only rendered when they become visible. Each tile is resampled from the smallest 
+pyramid level that still has enough detail for the current scale, so the cost of a tile doesn't 
+depend on how large the scan is. Levels are built lazily by halving the previous one, and rendered 
+tiles are kept in an LRU cache so panning back and forth doesn't render them again.
+'''
+
+from __future__ import annotations
+
+
+from collections import OrderedDict
+from typing import Iterator, List, Tuple
+from PIL import Image
+
+TILE_SIZE = 256
+
+TileKey = Tuple[float,int,int,int]
+
+
+class TilePyramid():
+    ''' Lazily built pyramid of the levels of an image, and LRU cache of the tiles rendered from them. '''
+
+    def level(self, scale: float) -> Tuple[Image.Image,float]:
+        ''' Return the smallest level with enough detail for the scale, along with the scale of that level. '''
+        level = 0
+        while 0.5**(level + 1) >= scale and min(self.levels[level].size) > TILE_SIZE:
+            if len(self.levels) == level + 1: self.levels.append(self.levels[level].reduce(2))
+            level += 1
+        return self.levels[level], 0.5**level
+
+    def scaled_size(self, scale: float) -> Tuple[int,int]: 
+        ''' Return the size of the whole image at the scale. '''
+        return tuple((int(dimension*scale) for dimension in self.image.size))
+
+    def tiles_in(self, scale: float, region: Tuple[int,int,int,int]) -> Iterator[Tuple[int,int]]:
+        ''' Return the (column, row) of every tile touching the region of the image at the scale. '''
+        width, height = self.scaled_size(scale)
+        left, top = max(region[0],0)//TILE_SIZE, max(region[1],0)//TILE_SIZE
+        right, bottom = (min(region[2],width) - 1)//TILE_SIZE, (min(region[3],height) - 1)//TILE_SIZE
+        return ((column,row,) for row in range(top,bottom + 1) for column in range(left,right + 1))
+
+    def tile(self, scale: float, column: int, row: int, resampling: int) -> Image.Image:
+        ''' Return the tile at the column and row of the image at the scale, rendering it if it isn't cached. '''
+        key = (scale,column,row,resampling,)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+        level_image, level_scale = self.level(scale)
+        width, height = self.scaled_size(scale)
+        left, top = column*TILE_SIZE, row*TILE_SIZE
+        right, bottom = min(left + TILE_SIZE,width), min(top + TILE_SIZE,height)
+        ratio = level_scale/scale
+        source = (left*ratio,top*ratio,min(right*ratio,level_image.width),min(bottom*ratio,level_image.height),)
+        self.tiles[key] = level_image.resize((right - left,bottom - top,),resampling,box=source)
+        while len(self.tiles) > self.cache_size: self.tiles.popitem(last=False)
+        return self.tiles[key]
+
+    def __init__(self, image: Image.Image, cache_size: int = 192) -> None:
+        self.image = image
+        self.levels: List[Image.Image] = [image]
+        self.cache_size = cache_size
+        self.tiles: OrderedDict[TileKey,Image.Image] = OrderedDict()
@@ -53,9 +53,9 @@ class WordBoxToolTip(Hovertip):
 
     def calculate_position(self, wordbox: WordBox):
         ''' Set the position of the tooltip to just above the box. '''
-        edges = filter(lambda edge: edge.name in ('left','top'),wordbox.rendered.edges) 
-        [self.x,self.y] = [edge.displacement for edge in edges]
-        self.y = the.buffered_image.height - self.y - 25
+        left, top, _, _ = wordbox.rendered.scaled
+        self.x = left - the.viewport[0]
+        self.y = the.rendered_size[1] - top - 25 - the.viewport[1]
     
     def get_position(self): 
         ''' Give the HoverTip object the location it needs. This method has to be overloaded. '''
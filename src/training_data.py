@@ -0,0 +1,232 @@
+#
+#    HyperKyube: OCR Gui MultiTool.
+#
+#    Copyright 2022 Daniel Gesua
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#   
+
+'''
+Command line tool that builds LSTM training data from corrected box files: it turns every box/tiff pair 
+in a directory tree into a ".lstmf" file with tesseract, running several pairs at once in a pool of worker 
+processes, and writes the training list of all the ".lstmf" files:
+
+    python training_data.py <directory> [--dry-run] [--jobs N] [--lang eng] [--psm 6] [--force] [--list path]
+
+Dependencies are tracked make-style: the manifest at the root of the tree records the content hashes of the 
+box file and image every ".lstmf" file was built from, along with the settings and tesseract version. Only 
+the pairs whose inputs or settings changed since are rebuilt, so after a correction session only the edited 
+documents are processed. Hashes are only recomputed for files whose size or modification time changed.
+With --dry-run the plan of what would be rebuilt, and why, is printed without running anything.
+'''
+
+from __future__ import annotations
+
+
+import os
+import sys
+import json
+import time
+import argparse
+import pytesseract
+
+from functools import partial
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Tuple
+
+from box_cache import file_digest
+from box_writer import fsync_enabled, write_atomically
+from batch_lstmbox import IMAGE_SUFFIXES, run_in_pool, save_manifest
+from ocr_backends import run_command, tesseract_command, tesseract_config
+
+MANIFEST_NAME = '.lstmf_manifest.json'
+LIST_NAME = 'training_files.txt'
+DEFAULT_PSM = 6
+
+
+class Pair(NamedTuple):
+    ''' A box file and the image it describes, which together make one ".lstmf" file. '''
+    box_path: Path
+    img_path: Path
+
+    @property
+    def lstmf_path(self) -> Path: return self.img_path.with_suffix('.lstmf')
+
+
+class Step(NamedTuple):
+    ''' A pair that has to be built, and the reason why. '''
+    pair: Pair
+    reason: str
+
+
+class Outcome(NamedTuple):
+    ''' The result of building the ".lstmf" file of one pair. '''
+    pair: Pair
+    error: str
+
+
+def find_pairs(directory: Path) -> List[Pair]:
+    ''' Return every box file in the directory tree that has a corresponding tiff image, in order. '''
+    pairs = []
+    for box_path in sorted(directory.rglob('*.box')):
+        images = [path for path in box_path.parent.glob(f'{box_path.stem}.*') if path.suffix.lower() in IMAGE_SUFFIXES]
+        if images: pairs.append(Pair(box_path,sorted(images)[0]))
+    return pairs
+
+
+class DependencyTracker():
+    ''' 
+    Manifest of the inputs and settings every ".lstmf" file in the tree was built from, kept as a JSON file
+    at the root of the tree. Each input is recorded with its size, modification time and content hash.
+    '''
+
+    def key(self, path: Path) -> str: return path.relative_to(self.directory).as_posix()
+
+    def state(self, path: Path) -> Tuple[int,int,str]:
+        ''' 
+        Return the size, modification time and content hash of the file. The hash recorded in the manifest 
+        is reused if the size and modification time didn't change, otherwise the file is hashed again.
+        '''
+        stat = path.stat()
+        recorded = self.known_states.get(self.key(path))
+        if recorded and recorded[:2] == [stat.st_size,stat.st_mtime_ns]: return tuple(recorded)
+        state = (stat.st_size,stat.st_mtime_ns,file_digest(path).hex(),)
+        self.known_states[self.key(path)] = list(state)
+        return state
+
+    def reason_to_build(self, pair: Pair, settings: str) -> str|None:
+        ''' Return why the ".lstmf" file of the pair has to be built, or None if it's up to date. '''
+        entry = self.entries.get(self.key(pair.lstmf_path))
+        if entry is None: return 'never built'
+        if not pair.lstmf_path.exists(): return 'output missing'
+        if entry['settings'] != settings: return 'settings changed'
+        for role,path in zip(('box','image',),pair):
+            recorded = entry['inputs'].get(role)
+            if recorded is None or recorded['path'] != self.key(path): return f'{role} replaced'
+            if recorded['state'][2] != self.state(path)[2]: return f'{role} changed'
+        return None
+
+    def snapshot(self, pair: Pair) -> Dict[str,Dict]:
+        ''' Return the current state of the inputs of the pair, to be recorded once its ".lstmf" file is built from them. '''
+        return {role: {'path': self.key(path),'state': list(self.state(path))} for role,path in zip(('box','image',),pair)}
+
+    def record(self, pair: Pair, settings: str, inputs: Dict[str,Dict]):
+        ''' 
+        Remember the settings and the snapshot of the inputs the ".lstmf" file of the pair was just built from. 
+        The snapshot is taken before building, so inputs edited meanwhile are seen as changed on the next run.
+        '''
+        self.entries[self.key(pair.lstmf_path)] = {'inputs': inputs,'settings': settings}
+
+    def save(self): save_manifest(self.path,self.entries)
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self.path = directory / MANIFEST_NAME
+        self.entries: Dict[str,Dict] = json.loads(self.path.read_text()) if self.path.exists() else {}
+        self.known_states: Dict[str,List] = {recorded['path']: recorded['state'] 
+            for entry in self.entries.values() for recorded in entry['inputs'].values()}
+
+
+def tesseract_settings(lang: str, psm: int) -> str:
+    ''' Return the settings the ".lstmf" files are built with, including the tesseract version. '''
+    return f'lang={lang} psm={psm} tesseract={pytesseract.get_tesseract_version()}'
+
+
+def plan(tracker: DependencyTracker, pairs: List[Pair], settings: str, force: bool = False) -> List[Step]:
+    ''' Return the steps needed to bring the ".lstmf" files of the pairs up to date. '''
+    steps = [Step(pair,'forced' if force else tracker.reason_to_build(pair,settings)) for pair in pairs]
+    return [step for step in steps if step.reason]
+
+
+def build_lstmf(pair: Pair, lang: str, psm: int) -> Outcome:
+    ''' 
+    Build the ".lstmf" file of the pair in a worker process, reporting failures instead of raising them. 
+    Tesseract reads the box file next to the image, and writes to a temporary name that is then moved in place.
+    '''
+    partial_basename = pair.img_path.with_name(f'.{pair.img_path.stem}.partial')
+    partial_path = Path(f'{partial_basename}.lstmf')
+    try:
+        run_command(tesseract_command(pair.img_path,partial_basename,lang,tesseract_config('lstm.train',psm=psm)))
+        os.replace(partial_path,pair.lstmf_path)
+        return Outcome(pair,None)
+    except Exception as error:
+        return Outcome(pair,str(error).strip() or type(error).__name__)
+    finally:
+        partial_path.unlink(missing_ok=True)
+
+
+def write_training_list(pairs: List[Pair], list_path: Path):
+    ''' Write the list of the ".lstmf" files that exist, one absolute path per line, as tesseract's training expects. '''
+    lines = [f'{pair.lstmf_path.resolve()}\n' for pair in pairs if pair.lstmf_path.exists()]
+    write_atomically(list_path,''.join(lines).encode('utf-8'),fsync_enabled())
+    print(f'Wrote {len(lines)} file(s) to {list_path}.',flush=True)
+
+
+def run_build(directory: str, jobs: int = None, lang: str = 'eng', psm: int = DEFAULT_PSM, force: bool = False, 
+    dry_run: bool = False, list_path: str = None) -> Tuple[int,int,bool]:
+    ''' 
+    Build the ".lstmf" files of the pairs in the directory tree that are out of date and write the training list.
+    Return how many were built and failed, and whether the build was cancelled with Ctrl+C.
+    '''
+    directory = Path(directory)
+    tracker = DependencyTracker(directory)
+    pairs = find_pairs(directory)
+    settings = tesseract_settings(lang,psm)
+    steps = plan(tracker,pairs,settings,force)
+    print(f'{len(steps)} of {len(pairs)} pair(s) to build.',flush=True)
+    if dry_run:
+        for step in steps: print(f'{step.pair.lstmf_path}: {step.reason}')
+        return 0, 0, False
+    built = failed = 0
+    started = time.perf_counter()
+
+    def finished(outcome: Outcome, inputs: Dict[str,Dict]):
+        nonlocal built, failed
+        if outcome.error: failed += 1
+        else:
+            built += 1
+            tracker.record(outcome.pair,settings,inputs)
+        done, elapsed = built + failed, time.perf_counter() - started
+        status = f'failed: {outcome.error}' if outcome.error else 'ok'
+        print(f'[{done}/{len(steps)}] {done/elapsed:.2f} pairs/s {outcome.pair.lstmf_path}: {status}',flush=True)
+
+    work = partial(build_lstmf,lang=lang,psm=psm)
+    pairs_to_build = [step.pair for step in steps]
+    try: cancelled = run_in_pool(work,pairs_to_build,finished,jobs,pytesseract.pytesseract.tesseract_cmd,tracker.snapshot,'pair')
+    finally: tracker.save()
+    write_training_list(pairs,Path(list_path) if list_path else directory / LIST_NAME)
+    print(f'{built} built, {len(pairs) - len(steps)} up to date, {failed} failed in {time.perf_counter() - started:.1f}s.',flush=True)
+    return built, failed, cancelled
+
+
+def main(arguments: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Build the LSTM training data of every box/tiff pair in a directory tree.')
+    parser.add_argument('directory',help='root of the directory tree containing the box files and images')
+    parser.add_argument('-n','--dry-run',action='store_true',help='only print what would be built and why')
+    parser.add_argument('-j','--jobs',type=int,default=None,help='number of worker processes (default: one per CPU)')
+    parser.add_argument('-l','--lang',default='eng',help='tesseract language to build the training data with')
+    parser.add_argument('--psm',type=int,default=DEFAULT_PSM,help=f'page segmentation mode (default: {DEFAULT_PSM})')
+    parser.add_argument('-f','--force',action='store_true',help='rebuild everything, even if it is up to date')
+    parser.add_argument('--list',default=None,help=f'path of the training list (default: {LIST_NAME} in the directory)')
+    parser.add_argument('--tesseract',default=None,help='path to the tesseract executable')
+    args = parser.parse_args(arguments)
+    if args.tesseract: pytesseract.pytesseract.tesseract_cmd = args.tesseract
+    try:
+        _, failed, cancelled = run_build(args.directory,args.jobs,args.lang,args.psm,args.force,args.dry_run,args.list)
+    except KeyboardInterrupt:
+        return 130
+    return 130 if cancelled else 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
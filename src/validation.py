@@ -0,0 +1,130 @@
+#
+#    HyperKyube: OCR Gui MultiTool.
+#
+#    Copyright 2022 Daniel Gesua
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#   
+
+'''
+Validation engine that lints the word boxes of a box file for problems which would otherwise
+only surface later as rendering glitches or failures during tesseract training.
+
+All per-box checks are vectorized over the columns of the box store, and overlapping boxes are
+found with a sweep-line over the left edges, so linting whole corpora stays fast.
+It can also be run from the command line to lint every box file in a directory tree:
+
+    python validation.py <directory>
+'''
+
+from __future__ import annotations
+
+
+import sys
+import heapq
+import numpy as np
+
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+from PIL import Image
+
+from parsing import BoxStore, COLUMN_INDEX, parse
+
+LEFT, BOTTOM, RIGHT, TOP, PAGE = (COLUMN_INDEX[name] for name in ['left','bottom','right','top','page'])
+
+
+class Issue(NamedTuple):
+    ''' A single problem found in a box. '''
+    row: int
+    page: int
+    kind: str
+    message: str
+
+
+def image_sizes(img_path: str) -> Dict[int,Tuple[int,int]]:
+    ''' Return the size of each page of an image file, reading only the frame headers. '''
+    with Image.open(img_path) as image:
+        sizes = {}
+        for page in range(getattr(image,'n_frames',1)):
+            image.seek(page)
+            sizes[page] = image.size
+        return sizes
+
+
+def overlapping_pairs(coordinates: np.ndarray) -> Iterator[Tuple[int,int]]:
+    ''' 
+    Yield the index pairs of all boxes whose areas overlap, using a sweep-line over the left edges.
+    Only the boxes that are still open at the sweep position are compared, instead of every pair.
+    '''
+    order = np.argsort(coordinates[:,LEFT],kind='stable').tolist()
+    boxes = coordinates[:,[LEFT,BOTTOM,RIGHT,TOP]].tolist()
+    open_boxes: List[Tuple[int,int]] = []
+    for index in order:
+        left, bottom, right, top = boxes[index]
+        while open_boxes and open_boxes[0][0] <= left: heapq.heappop(open_boxes)
+        for _, other in open_boxes:
+            if bottom < boxes[other][3] and boxes[other][1] < top: yield other, index
+        heapq.heappush(open_boxes,(right,index))
+
+
+def lint(store: BoxStore, rows: List[int] = None, sizes: Dict[int,Tuple[int,int]] = None) -> List[Issue]:
+    ''' 
+    Return the issues found in the rows of the store (all of them by default). Boxes are checked 
+    against the image bounds of their page when the sizes of the pages are known.
+    '''
+    rows = np.arange(len(store)) if rows is None else np.asarray(rows,dtype=np.int64)
+    coordinates = store.coordinates[rows]
+    left, bottom, right, top, page = coordinates.T
+    text_lengths = store.text_lengths()[rows]
+    checks = {
+        'inverted': ((left > right) | (bottom > top), 'The box edges are inverted.'),
+        'zero-area': ((left == right) | (bottom == top), 'The box has no area.'),
+        'empty-text': (text_lengths == 0, 'The box has no text.'),
+    }
+    if sizes:
+        widths = np.array([sizes.get(number,(np.inf,np.inf))[0] for number in page.tolist()])
+        heights = np.array([sizes.get(number,(np.inf,np.inf))[1] for number in page.tolist()])
+        outside = (np.minimum(left,bottom) < 0) | (right > widths) | (top > heights)
+        checks['out-of-bounds'] = (outside, 'The box lies outside the image bounds.')
+    issues = [Issue(int(rows[index]),int(page[index]),kind,message) 
+        for kind,(failed,message) in checks.items() for index in np.flatnonzero(failed).tolist()]
+    by_page = np.argsort(page,kind='stable')
+    page_numbers, page_starts = np.unique(page[by_page],return_index=True)
+    for number,on_page in zip(page_numbers.tolist(),np.split(by_page,page_starts[1:])):
+        for first,second in overlapping_pairs(coordinates[on_page]):
+            first_row, second_row = int(rows[on_page[first]]), int(rows[on_page[second]])
+            message = f'The box overlaps the box with the text "{store.text(first_row)}".'
+            issues.append(Issue(second_row,number,'overlap',message))
+    return issues
+
+
+def lint_file(box_path: Path) -> List[Issue]:
+    ''' Lint a box file against the pages of its corresponding image, if there is one. '''
+    img_path = next(box_path.parent.glob(f'{box_path.stem}.tif*'),None)
+    sizes = image_sizes(str(img_path)) if img_path else None
+    return lint(parse(str(box_path)),sizes=sizes)
+
+
+def lint_directory(directory: str) -> int:
+    ''' Lint every box file in the directory tree, print the issues found and return how many there were. '''
+    issue_count = 0
+    for box_path in sorted(Path(directory).rglob('*.box')):
+        for issue in (issues := lint_file(box_path)):
+            print(f'{box_path}:{issue.row}: page {issue.page}: [{issue.kind}] {issue.message}')
+        issue_count += len(issues)
+    print(f'{issue_count} issue(s) found.')
+    return issue_count
+
+
+if __name__ == '__main__':
+    sys.exit(1 if lint_directory(sys.argv[1] if len(sys.argv) > 1 else '.') else 0)
@@ -0,0 +1,59 @@
+#
+#    HyperKyube: OCR Gui MultiTool.
+#
+#    Copyright 2022 Daniel Gesua
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#   
+
+import pytest
+
+from global_scope import real_global_scope as the
+from parsing import BoxStore, WordBoxCore
+from rendered_geometry import WordBoxes
+from edit_history import DeleteDelta
+
+BOX_TEXT = ''.join(f'{letter} 10 10 50 30 {page}\n' for page in (0,1) for letter in f'p{page}w0\t')
+PAGE_REGION = (0,0,100,100)
+POINT = (20,80)
+
+
+@pytest.fixture
+def boxes():
+    the.scale, the.rendered_size, the.page = 1.0, (100,100,), 0
+    yield WordBoxes(BoxStore.from_text(BOX_TEXT))
+    the.page = 0
+
+
+def texts(wordboxes): return [wordbox.core.text for wordbox in wordboxes]
+
+
+def test_undoing_a_delete_from_another_page_keeps_the_box_off_the_current_page(boxes):
+    wordbox = boxes.select(POINT)
+    boxes.history.record(DeleteDelta(wordbox.core.row))
+    boxes.delete(wordbox)
+    the.page = 1
+    assert texts(boxes.overlapping(PAGE_REGION)) == ['p1w0']
+    assert boxes.history.undo()
+    assert texts(boxes.overlapping(PAGE_REGION)) == ['p1w0']
+    assert texts(boxes.containing(POINT)) == ['p1w0']
+    the.page = 0
+    assert texts(boxes.overlapping(PAGE_REGION)) == ['p0w0']
+
+
+def test_adding_a_box_to_another_page_keeps_it_off_the_current_page(boxes):
+    assert texts(boxes.overlapping(PAGE_REGION)) == ['p0w0']
+    boxes.add(WordBoxCore(boxes.store,1),page=1)
+    assert texts(boxes.overlapping(PAGE_REGION)) == ['p0w0']
+    the.page = 1
+    assert texts(boxes.overlapping(PAGE_REGION)) == ['p1w0','p1w0']